@@ -0,0 +1,896 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the embedded TTS/STT server.
+
+Each run starts its own server.py on a free port with the configuration
+under test, drives it over HTTP and stops it again, so results don't
+depend on whatever server happens to be running. Standard library only
+(psutil is used if installed).
+
+    python bench.py --json run.json suite --concurrency 1 4 --requests 20
+    python bench.py compare baseline.json run.json
+    python bench.py stt-scaling --max-processes 4 --requests 48 --concurrency 16
+    python bench.py tts-formats --requests 10
+    python bench.py soak --requests 5000
+    python bench.py server-runtime --requests 2000 --concurrency 16
+    python bench.py provision
+"""
+
+import argparse
+import hashlib
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+try:
+    import psutil  # optional; /proc is read instead on Linux
+except ImportError:
+    psutil = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, "bench_fixtures")
+DEFAULT_UTTERANCE = (
+    "I think the most important thing about learning a language is practising "
+    "every day, even if it is only for a few minutes."
+)
+
+
+class BenchServer:
+    """server.py in a child process, with its own port and environment."""
+
+    def __init__(self, env: Optional[dict] = None, startup_timeout: float = 300):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, HOST="127.0.0.1", PORT=str(self.port), **(env or {}))
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "BenchServer":
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "server.py")],
+            cwd=HERE, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited during startup (code {self.process.returncode})")
+            try:
+                health = self.get_json("/health")
+            except (OSError, ValueError):
+                health = {}
+            if health.get("ready"):
+                return self
+            failed = [name for name, c in health.get("components", {}).items() if c.get("state") == "failed"]
+            if failed:
+                self.__exit__()
+                raise RuntimeError(f"server failed to load {', '.join(failed)}")
+            time.sleep(0.5)
+        self.__exit__()
+        raise RuntimeError(f"server not ready after {self.startup_timeout:.0f}s")
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def get_json(self, path: str) -> dict:
+        with urllib.request.urlopen(self.base_url + path, timeout=5) as response:
+            return json.load(response)
+
+    def speech(self, text: str, **params) -> bytes:
+        return self.speech_response(text, **params)[0]
+
+    def speech_response(self, text: str, **params):
+        """(body, headers) of a /v1/audio/speech request."""
+        body = json.dumps(dict({"input": text}, **params)).encode()
+        request = urllib.request.Request(self.base_url + "/v1/audio/speech", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.read(), response.headers
+
+    def transcribe(self, audio: bytes, filename: str = "audio.wav", **fields) -> dict:
+        body, content_type = _multipart({"file": (filename, audio)}, fields)
+        request = urllib.request.Request(self.base_url + "/v1/audio/transcriptions", data=body,
+                                         headers={"Content-Type": content_type})
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.load(response)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _multipart(files: dict, fields: dict):
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, value in fields.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                  f'filename="{filename}"\r\nContent-Type: audio/wav\r\n\r\n'.encode())
+        out.write(data)
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
+    return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _wav_seconds(data: bytes) -> float:
+    with wave.open(io.BytesIO(data)) as w:
+        return w.getnframes() / w.getframerate()
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _dir_usage(path: str):
+    """(file count, total bytes) under path."""
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return files, size
+
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and its descendants (the STT worker processes)."""
+    if psutil is not None:
+        try:
+            return [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return [pid]
+    parents = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree = [pid]
+    for parent in tree:
+        tree.extend(child for child, ppid in parents.items() if ppid == parent)
+    return tree
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time consumed by pid so far."""
+    if psutil is not None:
+        try:
+            times = psutil.Process(pid).cpu_times()
+            return times.user + times.system
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class _ResourceSampler:
+    """Peak/final RSS and CPU time of the server (and its workers) over a block."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.rss_peak = 0
+        self.rss_end = 0
+        self._stop = threading.Event()
+
+    def _tree(self, measure) -> Optional[float]:
+        values = [measure(pid) for pid in _process_tree(self.pid)]
+        values = [value for value in values if value is not None]
+        return sum(values) if values else None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.rss_peak = max(self.rss_peak, self._tree(_rss_bytes) or 0)
+
+    def __enter__(self) -> "_ResourceSampler":
+        self._cpu_start = self._tree(_cpu_seconds)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.wall_s = time.perf_counter() - self._started
+        self.rss_end = self._tree(_rss_bytes) or 0
+        self.rss_peak = max(self.rss_peak, self.rss_end)
+        cpu_end = self._tree(_cpu_seconds)
+        self.cpu_s = cpu_end - self._cpu_start if cpu_end is not None and self._cpu_start is not None else None
+
+    def result(self) -> dict:
+        return {
+            "rss_peak_mb": round(self.rss_peak / 2 ** 20, 1) if self.rss_peak else None,
+            "rss_end_mb": round(self.rss_end / 2 ** 20, 1) if self.rss_end else None,
+            "cpu_s": round(self.cpu_s, 2) if self.cpu_s is not None else None,
+            # Average cores busy over the run.
+            "cpu_cores": round(self.cpu_s / self.wall_s, 2) if self.cpu_s is not None and self.wall_s else None,
+        }
+
+
+def _fire(fn, count: int, concurrency: int) -> dict:
+    """Call fn() count times from `concurrency` threads; throughput and latency."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            fn()
+        except (OSError, http.client.HTTPException):  # includes HTTPError (429s under overload)
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(count)))
+    wall_s = time.perf_counter() - started
+    return {
+        "requests": count,
+        "errors": errors,
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(latencies) / wall_s, 2) if wall_s else 0.0,
+        "p50_ms": round(_percentile(latencies, 50)) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 95)) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99)) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies)) if latencies else None,
+    }
+
+
+def stt_scaling(args) -> List[dict]:
+    """Transcription throughput with 0 (in-process) and 1..N worker processes."""
+    audio = open(args.audio, "rb").read() if args.audio else None
+    results = []
+    for processes in [0] + list(range(1, args.max_processes + 1)):
+        env = {"EMBEDDED_STT_PROCESSES": str(processes), "EMBEDDED_WHISPER_MODEL": args.model,
+               "EMBEDDED_STT_QUEUE": str(args.requests), "EMBEDDED_LAZY_LOAD": "" if audio is None else "tts"}
+        with BenchServer(env) as server:
+            if audio is None:
+                # No fixture given: let the server speak one to itself.
+                audio = server.speech(DEFAULT_UTTERANCE, voice="female", speed=1.0)
+            server.transcribe(audio)  # one untimed request
+            result = _fire(lambda: server.transcribe(audio), args.requests, args.concurrency)
+        result.update(processes=processes, audio_s=round(_wav_seconds(audio), 2))
+        results.append(result)
+        print(f"processes={processes:<2} {result['throughput_rps']:>6.2f} req/s  "
+              f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  errors {result['errors']}", flush=True)
+    baseline = results[1]["throughput_rps"] if len(results) > 1 else 0
+    for result in results:
+        result["speedup_vs_1"] = round(result["throughput_rps"] / baseline, 2) if baseline else None
+    return results
+
+
+def tts_formats(args) -> List[dict]:
+    """Bytes on the wire and end-to-end latency for each response_format."""
+    text = args.text or DEFAULT_UTTERANCE
+    results = []
+    # Cache off: every request pays synthesis + encoding, as a new line would.
+    with BenchServer({"EMBEDDED_TTS_CACHE_MB": "0", "EMBEDDED_LAZY_LOAD": "stt"}) as server:
+        wav_bytes = None
+        for response_format in args.formats:
+            try:
+                server.speech_response(text, voice="female", response_format=response_format)
+            except OSError as e:
+                print(f"{response_format:<5} unsupported by this server ({e})", flush=True)
+                continue
+            sizes, encode_ms = [], []
+
+            def one():
+                body, headers = server.speech_response(text, voice="female", response_format=response_format)
+                sizes.append(len(body))
+                encode_ms.append(float(headers.get("X-Encode-Ms") or 0))
+
+            result = _fire(one, args.requests, 1)
+            result.update(format=response_format, bytes=max(sizes) if sizes else None,
+                          encode_ms=round(statistics.mean(encode_ms), 1) if encode_ms else None)
+            if response_format == "wav":
+                wav_bytes = result["bytes"]
+            results.append(result)
+            print(f"{response_format:<5} {result['bytes']:>8} bytes  p50 {result['p50_ms']} ms  "
+                  f"p95 {result['p95_ms']} ms  encode {result['encode_ms']} ms", flush=True)
+    for result in results:
+        if wav_bytes and result["bytes"]:
+            result["ratio_vs_wav"] = round(result["bytes"] / wav_bytes, 3)
+    return results
+
+
+def soak(args) -> List[dict]:
+    """Thousands of TTS requests; temp-dir usage and server RSS must stay flat."""
+    temp_dir = tempfile.mkdtemp(prefix="bench-soak-")
+    # Cache off, so the memory it legitimately fills doesn't read as a leak.
+    env = {"TMPDIR": temp_dir, "TEMP": temp_dir, "TMP": temp_dir,
+           "EMBEDDED_TTS_CACHE_MB": "0", "EMBEDDED_LAZY_LOAD": "stt"}
+    sentences = [s.strip() + "." for s in DEFAULT_UTTERANCE.split(",")]
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+
+    def one():
+        with lock:
+            i = next(counter)
+        response_format = args.formats[i % len(args.formats)]
+        server.speech(sentences[i % len(sentences)], voice="female", response_format=response_format)
+
+    samples = []
+    with BenchServer(env) as server:
+        pid = server.process.pid
+        _fire(one, args.warmup, args.concurrency)
+        baseline_rss = _rss_bytes(pid)
+        baseline_files, baseline_bytes = _dir_usage(temp_dir)
+        done = 0
+        while done < args.requests:
+            batch = min(args.sample_every, args.requests - done)
+            result = _fire(one, batch, args.concurrency)
+            done += batch
+            files, size = _dir_usage(temp_dir)
+            rss = _rss_bytes(pid)
+            samples.append({"requests": done, "rss_mb": round(rss / 2 ** 20, 1) if rss else None,
+                            "temp_files": files, "temp_bytes": size, "errors": result["errors"],
+                            "p50_ms": result["p50_ms"]})
+            print(f"{done:>6} requests  rss {samples[-1]['rss_mb']} MB  temp {files} files / {size} bytes  "
+                  f"p50 {result['p50_ms']} ms  errors {result['errors']}", flush=True)
+
+    rss_growth_mb = (samples[-1]["rss_mb"] - baseline_rss / 2 ** 20) if baseline_rss and samples[-1]["rss_mb"] else 0.0
+    failures = []
+    if (samples[-1]["temp_files"], samples[-1]["temp_bytes"]) != (baseline_files, baseline_bytes):
+        failures.append(f"temp dir grew from {baseline_files} files / {baseline_bytes} bytes to "
+                        f"{samples[-1]['temp_files']} files / {samples[-1]['temp_bytes']} bytes")
+    if rss_growth_mb > args.max_rss_growth_mb:
+        failures.append(f"RSS grew {rss_growth_mb:.1f} MB (limit {args.max_rss_growth_mb} MB)")
+    if any(sample["errors"] for sample in samples):
+        failures.append(f"{sum(sample['errors'] for sample in samples)} request(s) failed")
+    print("PASS" if not failures else "FAIL: " + "; ".join(failures), flush=True)
+    return [{"samples": samples, "rss_growth_mb": round(rss_growth_mb, 1), "failures": failures}]
+
+
+class _StandIn:
+    """Local HTTP stand-in for the model host: serves byte strings by path,
+    honours Range (unless told not to), and can cut a response short."""
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self.cut_after: Dict[str, int] = {}  # path → bytes sent before dropping, once
+        self.honour_range = True
+        self.requests: List[tuple] = []  # (path, Range header)
+        self.active = 0
+        self.peak_active = 0
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests.append((self.path, self.headers.get("Range")))
+                    stand_in.active += 1
+                    stand_in.peak_active = max(stand_in.peak_active, stand_in.active)
+                try:
+                    self._send(stand_in)
+                finally:
+                    with stand_in._lock:
+                        stand_in.active -= 1
+
+            def _send(self, stand_in):
+                data = stand_in.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                start = 0
+                requested = self.headers.get("Range", "")
+                if requested.startswith("bytes=") and stand_in.honour_range:
+                    start = int(requested[len("bytes="):].split("-")[0])
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                body = data[start:]
+                cut = stand_in.cut_after.pop(self.path, None)
+                if cut is not None:
+                    self.wfile.write(body[:cut])
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                time.sleep(0.2)  # long enough for parallel downloads to overlap
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def provision(args) -> List[dict]:
+    """Model provisioning against a local stand-in: parallel fetch, resume,
+    ignored Range, 416, checksum mismatch and the .verified.json fast path."""
+    sys.path.insert(0, HERE)
+    import server  # in-process: pinned hashes are swapped for the stand-in's files
+
+    stand_in = _StandIn()
+    server._MODEL_MIRROR = stand_in.url
+    server._OFFLINE = False
+    work = tempfile.mkdtemp(prefix="bench-provision-")
+    rows = []
+
+    def model(name: str, size: int) -> tuple:
+        path = f"/rhasspy/piper-voices/resolve/v1.0.0/en/{name}"
+        data = os.urandom(size)
+        stand_in.files[path] = data
+        return server._HF_BASE + path, hashlib.sha256(data).hexdigest(), data
+
+    def check(name: str, fn):
+        stand_in.requests.clear()
+        directory = os.path.join(work, name)
+        os.makedirs(directory)
+        started = time.perf_counter()
+        try:
+            failure = fn(directory)
+        except Exception as e:
+            failure = f"{type(e).__name__}: {e}"
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        rows.append({"scenario": name, "ms": round(elapsed_ms, 1), "requests": len(stand_in.requests),
+                     "failures": [failure] if failure else []})
+        print(f"{name:<18} {'ok' if not failure else 'FAIL: ' + failure}  "
+              f"({len(stand_in.requests)} request(s), {elapsed_ms:.0f} ms)", flush=True)
+
+    def fetched(dest: str, data: bytes) -> Optional[str]:
+        if not os.path.exists(dest) or open(dest, "rb").read() != data:
+            return "file missing or wrong"
+        if os.path.exists(f"{dest}.part"):
+            return ".part left behind"
+        return None
+
+    def parallel(directory):
+        files = {f"voice{i}.onnx": model(f"voice{i}.onnx", 2_000_000 + i)[:2] for i in range(4)}
+        server._PIPER_MODELS, server._MODELS_DIR = files, directory
+        server._provision_piper_models()
+        for filename, (_url, sha256) in files.items():
+            if server._sha256_of(os.path.join(directory, filename)) != sha256:
+                return f"{filename} missing or wrong"
+        if stand_in.peak_active < 2:
+            return "downloads did not overlap"
+
+    def resume(directory):
+        url, sha256, data = model("resume.onnx", 3_000_000)
+        stand_in.cut_after[url[len(server._HF_BASE):]] = 1_000_000
+        dest = os.path.join(directory, "resume.onnx")
+        server._provision(dest, url, sha256)
+        if stand_in.requests[-1][1] != "bytes=1000000-":
+            return f"retry sent Range {stand_in.requests[-1][1]!r}"
+        return fetched(dest, data)
+
+    def ignored_range(directory):
+        url, sha256, data = model("norange.onnx", 1_000_000)
+        dest = os.path.join(directory, "norange.onnx")
+        with open(f"{dest}.part", "wb") as f:
+            f.write(b"stale prefix")
+        stand_in.honour_range = False
+        try:
+            server._provision(dest, url, sha256)
+        finally:
+            stand_in.honour_range = True
+        return fetched(dest, data)
+
+    def range_not_satisfiable(directory):
+        url, sha256, data = model("overlong.onnx", 500_000)
+        dest = os.path.join(directory, "overlong.onnx")
+        with open(f"{dest}.part", "wb") as f:
+            f.write(os.urandom(600_000))
+        server._provision(dest, url, sha256)
+        if [r for _path, r in stand_in.requests] != ["bytes=600000-", None]:
+            return f"unexpected requests {stand_in.requests}"
+        return fetched(dest, data)
+
+    def checksum_mismatch(directory):
+        url, sha256, _data = model("poisoned.onnx", 500_000)
+        stand_in.files[url[len(server._HF_BASE):]] = b"not the model" * 1000
+        dest = os.path.join(directory, "poisoned.onnx")
+        try:
+            server._provision(dest, url, sha256)
+        except ValueError:
+            pass
+        else:
+            return "mismatch was accepted"
+        if os.path.exists(dest) or os.path.exists(f"{dest}.part"):
+            return "poisoned bytes left on disk"
+
+    def verified(directory):
+        url, sha256, data = model("verified.onnx", 500_000)
+        dest = os.path.join(directory, "verified.onnx")
+        server._provision(dest, url, sha256)
+        before = len(stand_in.requests)
+        server._provision(dest, url, sha256)
+        if len(stand_in.requests) != before:
+            return "verified file was downloaded again"
+        with open(dest, "r+b") as f:  # same size, different bytes, new mtime
+            f.write(b"X")
+        server._provision(dest, url, sha256)
+        if len(stand_in.requests) != before + 1:
+            return "tampered file was not downloaded again"
+        return fetched(dest, data)
+
+    try:
+        check("parallel", parallel)
+        check("resume", resume)
+        check("ignored-range", ignored_range)
+        check("416", range_not_satisfiable)
+        check("checksum-mismatch", checksum_mismatch)
+        check("verified", verified)
+    finally:
+        stand_in.close()
+        shutil.rmtree(work, ignore_errors=True)
+    failed = [row["scenario"] for row in rows if row["failures"]]
+    print("PASS" if not failed else "FAIL: " + ", ".join(failed), flush=True)
+    return rows
+
+
+class _KeepAliveClient:
+    """One persistent HTTP/1.1 connection per calling thread."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                content_type: str = "application/json") -> bytes:
+        return self.request_timed(method, path, body, content_type)[0]
+
+    def request_timed(self, method: str, path: str, body: Optional[bytes] = None,
+                      content_type: str = "application/json"):
+        """(body, time to first body byte in ms)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": content_type})
+            response = conn.getresponse()
+            first = response.read(1)
+            ttfb_ms = (time.perf_counter() - started) * 1000
+            data = first + response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status >= 400:
+            raise OSError(f"HTTP {response.status}")
+        return data, ttfb_ms
+
+
+def server_runtime(args) -> List[dict]:
+    """Requests/s and tail latency: Werkzeug dev server vs waitress."""
+    speech = json.dumps({"input": "Sorry, could you say that again?", "voice": "female"}).encode()
+    results = []
+    for runtime in args.runtimes:
+        with BenchServer({"EMBEDDED_SERVER": runtime, "EMBEDDED_LAZY_LOAD": "stt",
+                          "EMBEDDED_SERVER_THREADS": str(args.threads)}) as server:
+            client = _KeepAliveClient(server.port)
+            client.request("POST", "/v1/audio/speech", speech)  # prime the TTS cache
+            workloads = {
+                "health": lambda: client.request("GET", "/health"),
+                # Cache hit: mostly HTTP + framework cost, with a real payload.
+                "speech-cached": lambda: client.request("POST", "/v1/audio/speech", speech),
+            }
+            for name, fn in workloads.items():
+                result = _fire(fn, args.requests, args.concurrency)
+                result.update(runtime=runtime, workload=name)
+                results.append(result)
+                print(f"{runtime:<9} {name:<14} {result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']} ms  "
+                      f"p99 {result['p99_ms']} ms  errors {result['errors']}", flush=True)
+    return results
+
+
+def _load_corpus(path: str) -> dict:
+    with open(path, "rb") as f:
+        raw = f.read()
+    corpus = json.loads(raw)
+    corpus["sha256"] = hashlib.sha256(raw).hexdigest()
+    return corpus
+
+
+def _require_local_voices():
+    # The suite runs with EMBEDDED_OFFLINE=1, which won't fetch voices.
+    missing = [name for name in ("en_GB-alan-low.onnx", "en_US-amy-low.onnx")
+               if not os.path.exists(os.path.join(HERE, "models", name))]
+    if missing:
+        sys.exit(f"missing Piper voice(s) in models/: {', '.join(missing)} — run setup.sh first "
+                 f"(the suite never downloads)")
+
+
+def _audio_fixtures(server: BenchServer, corpus: dict, audio_dir: str) -> Dict[str, bytes]:
+    """One WAV per corpus length listed under "stt", read from audio_dir.
+
+    A missing fixture is rendered once from the first line of that length
+    by the server's local voice and saved, so later runs (and other
+    machines, if it is committed) transcribe identical audio."""
+    os.makedirs(audio_dir, exist_ok=True)
+    fixtures = {}
+    for length in corpus["stt"]:
+        path = os.path.join(audio_dir, f"{length}.wav")
+        if not os.path.exists(path):
+            audio = server.speech(corpus["tts"][length][0], voice=corpus["voice"], speed=1.0)
+            with open(path + ".part", "wb") as f:
+                f.write(audio)
+            os.replace(path + ".part", path)
+            print(f"rendered fixture {path} ({_wav_seconds(audio):.1f}s)", flush=True)
+        with open(path, "rb") as f:
+            fixtures[length] = f.read()
+    return fixtures
+
+
+class _Rotation:
+    """Thread-safe round robin over a fixed list of request bodies."""
+
+    def __init__(self, items: list):
+        self._items = itertools.cycle(items)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return next(self._items)
+
+
+def _suite_workloads(corpus: dict, audio: Dict[str, bytes], selected: List[str]) -> List[dict]:
+    workloads = []
+    for length, texts in corpus["tts"].items():
+        for stream in (False, True):
+            bodies = _Rotation([
+                json.dumps({"input": text, "voice": corpus["voice"], "speed": 1.0, "stream": stream}).encode()
+                for text in texts
+            ])
+            workloads.append({
+                "workload": f"tts-{length}" + ("-stream" if stream else ""), "kind": "tts", "length": length,
+                "request": lambda client, bodies=bodies: client.request_timed(
+                    "POST", "/v1/audio/speech", bodies.next()),
+            })
+    for length, data in audio.items():
+        body, content_type = _multipart({"file": (f"{length}.wav", data)}, {})
+        workloads.append({
+            "workload": f"stt-{length}", "kind": "stt", "length": length,
+            "audio_s": round(_wav_seconds(data), 2), "audio_sha256": hashlib.sha256(data).hexdigest()[:16],
+            "request": lambda client, body=body, content_type=content_type: client.request_timed(
+                "POST", "/v1/audio/transcriptions", body, content_type),
+        })
+    return [w for w in workloads if not selected or w["kind"] in selected or w["workload"] in selected]
+
+
+def suite(args) -> List[dict]:
+    """Throughput, latency, TTFB, RSS and CPU per workload and concurrency level."""
+    corpus = _load_corpus(args.corpus)
+    _require_local_voices()
+    queue = str(max(args.concurrency) * 2)
+    # Offline, and the TTS cache off so every request pays for synthesis.
+    env = {"EMBEDDED_OFFLINE": "1", "HF_HUB_OFFLINE": "1", "EMBEDDED_TTS_CACHE_MB": "0",
+           "EMBEDDED_WHISPER_MODEL": args.model, "EMBEDDED_TTS_QUEUE": queue, "EMBEDDED_STT_QUEUE": queue}
+    env.update(item.split("=", 1) for item in args.env)
+    results = []
+    with BenchServer(env) as server:
+        audio = _audio_fixtures(server, corpus, args.audio_dir) if corpus.get("stt") else {}
+        client = _KeepAliveClient(server.port)
+        for workload in _suite_workloads(corpus, audio, args.workloads):
+            request = workload.pop("request")
+            request(client)  # one untimed request
+            for concurrency in args.concurrency:
+                ttfbs: List[float] = []
+                lock = threading.Lock()
+
+                def one():
+                    ttfb_ms = request(client)[1]
+                    with lock:
+                        ttfbs.append(ttfb_ms)
+
+                with _ResourceSampler(server.process.pid) as sampler:
+                    result = _fire(one, args.requests, concurrency)
+                result.update(workload, concurrency=concurrency, corpus_version=corpus.get("version"),
+                              corpus_sha256=corpus["sha256"][:16])
+                result.update({f"ttfb_p{pct}_ms": round(_percentile(ttfbs, pct)) if ttfbs else None
+                               for pct in (50, 95, 99)})
+                result.update(sampler.result())
+                completed = result["requests"] - result["errors"]
+                result["cpu_ms_per_request"] = (round(result["cpu_s"] * 1000 / completed, 1)
+                                                if result["cpu_s"] is not None and completed else None)
+                results.append(result)
+                print(f"{result['workload']:<17} c={concurrency:<3} {result['throughput_rps']:>7.2f} req/s  "
+                      f"p50 {result['p50_ms']} / p95 {result['p95_ms']} / p99 {result['p99_ms']} ms  "
+                      f"ttfb p50 {result['ttfb_p50_ms']} ms  rss {result['rss_peak_mb']} MB  "
+                      f"cpu {result['cpu_ms_per_request']} ms/req  errors {result['errors']}", flush=True)
+    return results
+
+
+# Rows from two runs are matched on these fields; each compared metric
+# says whether higher (+1) or lower (-1) is better.
+_KEY_FIELDS = ("command", "workload", "concurrency", "processes", "format", "runtime")
+_COMPARED_METRICS = {
+    "throughput_rps": 1, "p50_ms": -1, "p95_ms": -1, "p99_ms": -1,
+    "ttfb_p50_ms": -1, "ttfb_p95_ms": -1, "rss_peak_mb": -1, "cpu_ms_per_request": -1,
+}
+
+
+def _row_key(command: str, row: dict) -> tuple:
+    return tuple(str(row.get(field, command if field == "command" else "")) for field in _KEY_FIELDS)
+
+
+def compare(args) -> List[dict]:
+    """Metric changes between two --json result files; gated metrics fail past --tolerance."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    base_rows = {_row_key(baseline["command"], row): row for row in baseline["results"]}
+    comparisons, failures = [], []
+    for row in current["results"]:
+        key = _row_key(current["command"], row)
+        base = base_rows.get(key)
+        if base is None:
+            continue
+        label = " ".join(part for part in key[1:] if part)
+        for metric, direction in _COMPARED_METRICS.items():
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change * direction < -args.tolerance
+            comparisons.append({"row": label, "metric": metric, "baseline": old, "current": new,
+                                "change": round(change, 3), "regressed": regressed})
+            flag = "  REGRESSED" if regressed and metric in args.gate else ""
+            print(f"{label:<28} {metric:<19} {old:>10} → {new:<10} {change:+7.1%}{flag}", flush=True)
+            if flag:
+                failures.append(f"{label} {metric} {change:+.1%}")
+    if not comparisons:
+        failures.append("no rows in common")
+    print("PASS" if not failures else "FAIL: " + "; ".join(failures), flush=True)
+    return [{"comparisons": comparisons, "failures": failures}]
+
+
+def _run_metadata(args) -> dict:
+    """What a later run needs to know to tell a regression from a different machine."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "run"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="also write results to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench_suite = commands.add_parser("suite", help="TTS/STT throughput, latency, TTFB, RSS and CPU over the corpus")
+    bench_suite.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="levels to run each workload at")
+    bench_suite.add_argument("--requests", type=int, default=20, help="requests per workload and level")
+    bench_suite.add_argument("--workloads", nargs="*", default=[],
+                             help="tts, stt or workload names such as tts-long-stream (default: all)")
+    bench_suite.add_argument("--corpus", default=os.path.join(FIXTURES, "corpus.json"))
+    bench_suite.add_argument("--audio-dir", default=os.path.join(FIXTURES, "audio"),
+                             help="<length>.wav STT fixtures (missing ones are rendered once)")
+    bench_suite.add_argument("--model", default="tiny", help="EMBEDDED_WHISPER_MODEL")
+    bench_suite.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE",
+                             help="extra server environment, e.g. EMBEDDED_TTS_WORKERS=2")
+    bench_suite.set_defaults(run=suite)
+
+    compare_runs = commands.add_parser("compare", help="diff two --json result files")
+    compare_runs.add_argument("baseline")
+    compare_runs.add_argument("current")
+    compare_runs.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as a regression")
+    compare_runs.add_argument("--gate", nargs="+", default=["throughput_rps", "p95_ms", "ttfb_p95_ms"],
+                              help="metrics whose regression fails the comparison")
+    compare_runs.set_defaults(run=compare)
+
+    scaling = commands.add_parser("stt-scaling", help="STT throughput vs EMBEDDED_STT_PROCESSES")
+    scaling.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    scaling.add_argument("--requests", type=int, default=48)
+    scaling.add_argument("--concurrency", type=int, default=16, help="simultaneous learners")
+    scaling.add_argument("--model", default="tiny")
+    scaling.add_argument("--audio", help="WAV fixture (default: synthesized by the server)")
+    scaling.set_defaults(run=stt_scaling)
+
+    formats = commands.add_parser("tts-formats", help="/v1/audio/speech size and latency per response_format")
+    formats.add_argument("--formats", nargs="+", default=["wav", "pcm", "flac", "opus", "ogg", "mp3"])
+    formats.add_argument("--requests", type=int, default=10, help="sequential requests per format")
+    formats.add_argument("--text", help=f"text to synthesize (default: {DEFAULT_UTTERANCE[:30]}...)")
+    formats.set_defaults(run=tts_formats)
+
+    soak_test = commands.add_parser("soak", help="assert temp-dir usage and server RSS stay flat under load")
+    soak_test.add_argument("--requests", type=int, default=5000)
+    soak_test.add_argument("--warmup", type=int, default=200, help="untracked requests before the RSS baseline")
+    soak_test.add_argument("--concurrency", type=int, default=4)
+    soak_test.add_argument("--sample-every", type=int, default=500)
+    soak_test.add_argument("--formats", nargs="+", default=["wav", "flac", "pcm"])
+    soak_test.add_argument("--max-rss-growth-mb", type=float, default=10.0)
+    soak_test.set_defaults(run=soak)
+
+    runtime = commands.add_parser("server-runtime", help="requests/s and p99: dev server vs waitress")
+    runtime.add_argument("--runtimes", nargs="+", default=["dev", "waitress"])
+    runtime.add_argument("--requests", type=int, default=2000)
+    runtime.add_argument("--concurrency", type=int, default=16)
+    runtime.add_argument("--threads", type=int, default=8, help="EMBEDDED_SERVER_THREADS")
+    runtime.set_defaults(run=server_runtime)
+
+    provisioning = commands.add_parser("provision", help="model downloads against a local stand-in server")
+    provisioning.set_defaults(run=provision)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"command": args.command, "meta": _run_metadata(args), "results": results}, f, indent=2)
+    if any(result.get("failures") for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,13 @@ source venv/bin/activate
 # Install PyInstaller if not already installed
 pip install pyinstaller
 
+# Bundle only the voices. A dev run leaves optimized graphs
+# (models/.optimized), the checksum cache (models/.verified.json) and
+# possibly interrupted *.part downloads in models/ too.
+rm -rf build/bundled-models
+mkdir -p build/bundled-models
+cp models/*.onnx models/*.onnx.json build/bundled-models/
+
 # Create the executable
 pyinstaller --onefile \
     --name server \
@@ -18,9 +25,10 @@ pyinstaller --onefile \
     --hidden-import=whisper \
     --hidden-import=flask \
     --hidden-import=flask_cors \
+    --hidden-import=waitress \
     --hidden-import=soundfile \
     --hidden-import=numpy \
-    --add-data "models:models" \
+    --add-data "build/bundled-models:models" \
     --distpath ../dist/embedded-server \
     server.py
 
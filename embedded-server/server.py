@@ -10,403 +10,2871 @@ import json
 import hashlib
 import hmac
 import logging
-import tempfile
+import logging.handlers
+import random
 import threading
+import uuid
+import functools
+import queue
+import time
 import io
+import struct
+import subprocess
 import base64
+import http.client
+import urllib.error
 import urllib.request
 import wave
-from typing import Dict, List, Optional
+import signal
+import contextlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 from flask_cors import CORS
-from piper import PiperVoice
+from piper import PiperConfig, PiperVoice, SynthesisConfig
+from pywhispercpp.constants import AVAILABLE_MODELS as WHISPER_MODELS
 from pywhispercpp.model import Model as WhisperModel
 import numpy as np
+import onnxruntime
 import soundfile as sf
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging. Records go onto a bounded queue and a listener
+# thread formats and writes them, so a slow stderr pipe (the Electron
+# parent reads it) never stalls a request or inference thread. A record
+# that finds the queue full is dropped and counted rather than waited on.
+class _AsyncLogHandler(logging.handlers.QueueHandler):
+    def __init__(self, capacity: int):
+        super().__init__(queue.Queue(maxsize=capacity))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue never leaves this process, so nothing has to be
+        # pre-rendered for pickling: formatting happens on the listener.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_handler = _AsyncLogHandler(int(os.environ.get("EMBEDDED_LOG_QUEUE", 10000)))
+_log_listener = logging.handlers.QueueListener(_log_handler.queue, _log_output)
+logging.basicConfig(level=os.environ.get("EMBEDDED_LOG_LEVEL", "INFO").upper(), handlers=[_log_handler])
+_log_listener.start()
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
+app = Flask(__name__)
+CORS(app)
+
+# Metrics. Per-stage latency histograms, request/error/byte counters and
+# (at scrape time) queue and model-memory gauges, exposed in Prometheus
+# text format at /metrics. Implemented here rather than via
+# prometheus_client to keep the bundled server dependency-free; the
+# label sets are small and fixed (endpoint = the matched route rule).
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    # %g would round byte counts; integers print exactly.
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(total)}")
+        return lines
+
+
+class _Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = _LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((values, list(series)) for values, series in self._series.items())
+        for values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.labels, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _gauge(name: str, help_text: str, labels: Tuple[str, ...], samples: Dict[tuple, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for values, value in sorted(samples.items()):
+        lines.append(f"{name}{_format_labels(labels, values)} {_format_value(value)}")
+    return lines
+
+
+_stage_seconds = _Histogram(
+    "embedded_stage_duration_seconds",
+    "Time spent in one pipeline stage (decode, ffmpeg, whisper, piper, cache_lookup).",
+    ("stage",),
+)
+_queue_wait_seconds = _Histogram(
+    "embedded_queue_wait_seconds", "Time an inference job waited for a worker.", ("engine",))
+_request_seconds = _Histogram(
+    "embedded_request_duration_seconds",
+    "Request handling time up to the response headers (streamed bodies continue after).",
+    ("endpoint", "method"),
+)
+_requests_total = _Counter(
+    "embedded_requests_total", "HTTP requests by route and status.", ("endpoint", "method", "status"))
+_request_errors_total = _Counter(
+    "embedded_request_errors_total", "HTTP responses with a 4xx/5xx status.", ("endpoint", "status"))
+_request_bytes_total = _Counter(
+    "embedded_request_bytes_total", "Request body bytes received.", ("endpoint",))
+_response_bytes_total = _Counter(
+    "embedded_response_bytes_total", "Response body bytes sent.", ("endpoint",))
+_METRICS = (_stage_seconds, _queue_wait_seconds, _request_seconds,
+            _requests_total, _request_errors_total, _request_bytes_total, _response_bytes_total)
+
+
+@contextlib.contextmanager
+def _timed(stage: str):
+    """Record the duration of the enclosed block in the stage histogram
+    and on the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _stage_seconds.observe(elapsed, stage)
+        trace = _current_trace()
+        if trace is not None:
+            trace.stage(stage, elapsed)
+
+
+class _CountingBody:
+    """Wraps a streamed response body to count the bytes actually sent."""
+
+    def __init__(self, body, endpoint: str, trace: Optional["_RequestTrace"]):
+        self._body = body
+        self._endpoint = endpoint
+        self._trace = trace
+
+    def __iter__(self):
+        for chunk in self._body:
+            size = len(chunk.encode() if isinstance(chunk, str) else chunk)
+            _response_bytes_total.inc(self._endpoint, amount=size)
+            if self._trace is not None:
+                self._trace.bytes_out += size
+            yield chunk
+
+    def close(self):
+        close = getattr(self._body, "close", None)
+        if close is not None:
+            close()
+
+
+def _endpoint_label() -> str:
+    # The route rule, not the path: /v1/audio/speech/cache/<audio_id>
+    # stays one series however many IDs are fetched.
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+# Request tracing. Each /v1/ request builds one structured record: stage
+# timings (shared with the histograms via _timed), queue wait, sizes, and
+# whatever the handler annotates (model, voice, audio length — never the
+# transcript or input text). It is logged once, when the response is
+# closed, as a JSON line on the "trace" logger, for a random
+# EMBEDDED_TRACE_SAMPLE fraction of requests plus every error and every
+# request slower than EMBEDDED_TRACE_SLOW_MS.
+_TRACE_SAMPLE = float(os.environ.get("EMBEDDED_TRACE_SAMPLE", 1.0))
+_TRACE_SLOW_MS = float(os.environ.get("EMBEDDED_TRACE_SLOW_MS", 2000))
+_trace_logger = logging.getLogger("trace")
+
+
+class _JSONMessage:
+    """Log argument serialized when the listener formats the record."""
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(self.data, separators=(",", ":"))
+
+
+class _RequestTrace:
+    def __init__(self, method: str, endpoint: str):
+        self.started = time.perf_counter()
+        self.fields: dict = {"method": method, "endpoint": endpoint}
+        self.stages: Dict[str, float] = {}
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def stage(self, name: str, seconds: float):
+        # Batch items add stages from several threads at once.
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def annotate(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.fields[name] = self.fields.get(name, 0) + amount
+
+    def finish(self):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            record = {key: self.fields[key] for key in ("id", "method", "endpoint", "status") if key in self.fields}
+            record.update(total_ms=round(total_ms, 1), stages={name: round(ms, 1) for name, ms in self.stages.items()},
+                          bytes_out=self.bytes_out)
+            record.update((key, value) for key, value in self.fields.items() if key not in record)
+        # A stream that failed after its 200 went out records an "error".
+        failed = record.get("status", 0) >= 400 or "error" in record
+        if not failed and total_ms < _TRACE_SLOW_MS and random.random() >= _TRACE_SAMPLE:
+            return
+        _trace_logger.info("%s", _JSONMessage(record))
+
+
+def _current_trace() -> Optional[_RequestTrace]:
+    """The trace of the request being served, on its own thread or on the
+    inference worker running a job for it."""
+    trace = getattr(_worker_local, "trace", None)
+    if trace is None and has_request_context():
+        trace = g.get("trace")
+    return trace
+
+
+def _annotate(**fields):
+    trace = _current_trace()
+    if trace is not None:
+        trace.annotate(**fields)
+
+
+@app.before_request
+def _start_request_clock():
+    g.request_started = time.perf_counter()
+    if request.path.startswith("/v1/") and request.method != "OPTIONS":
+        g.trace = _RequestTrace(request.method, _endpoint_label())
+
+
+@app.after_request
+def _record_request_metrics(response):
+    endpoint = _endpoint_label()
+    status = str(response.status_code)
+    trace = g.get("trace")
+    _requests_total.inc(endpoint, request.method, status)
+    if response.status_code >= 400:
+        _request_errors_total.inc(endpoint, status)
+    if request.content_length:
+        _request_bytes_total.inc(endpoint, amount=request.content_length)
+    if response.is_streamed:
+        response.response = _CountingBody(response.response, endpoint, trace)
+    elif response.content_length:
+        _response_bytes_total.inc(endpoint, amount=response.content_length)
+        if trace is not None:
+            trace.bytes_out = response.content_length
+    if "request_started" in g:
+        _request_seconds.observe(time.perf_counter() - g.request_started, endpoint, request.method)
+    if trace is not None:
+        trace.annotate(id=g.get("request_id"), status=response.status_code, bytes_in=request.content_length or 0)
+        # Finished on close, so a streamed response's synthesis is in it.
+        response.call_on_close(trace.finish)
+    return response
+
+
+# Localhost-only is not enough: any local process (and, via form POSTs,
+# potentially any webpage in the user's browser) can reach 127.0.0.1.
+# Electron main generates a per-session token and passes it via env;
+# every route except /health requires it. When the env var is absent
+# (running the server standalone in dev) auth is disabled.
+_AUTH_TOKEN = os.environ.get("EMBEDDED_AUTH_TOKEN", "")
+
+
+@app.before_request
+def _require_auth():
+    if not _AUTH_TOKEN or request.path == "/health":
+        return None
+    supplied = request.headers.get("Authorization", "")
+    if supplied.startswith("Bearer "):
+        supplied = supplied[len("Bearer "):]
+    if not hmac.compare_digest(supplied, _AUTH_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+# Set once shutdown starts: new inference is turned away while the
+# requests already in flight finish (see _graceful_shutdown).
+_draining = threading.Event()
+
+
+@app.before_request
+def _reject_while_draining():
+    if _draining.is_set() and request.path.startswith("/v1/"):
+        response = jsonify({"error": {"message": "Server is shutting down", "type": "shutting_down"}})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    return None
+
+
+@app.before_request
+def _register_request():
+    # Inference requests get an ID (client-supplied via X-Request-Id, or
+    # generated) that DELETE /v1/requests/<id> can cancel while in flight.
+    if not request.path.startswith("/v1/audio/") or request.method == "OPTIONS":
+        return None
+    request_id = request.headers.get("X-Request-Id", "")[:128] or uuid.uuid4().hex
+    with _inflight_lock:
+        if request_id in _inflight:
+            request_id = uuid.uuid4().hex
+        g.request_id = request_id
+        g.cancel = _inflight[request_id] = _CancelToken()
+    return None
+
+
+def _unregister_request(request_id: str):
+    with _inflight_lock:
+        _inflight.pop(request_id, None)
+
+
+@app.after_request
+def _report_inference_timing(response):
+    if "request_id" in g:
+        response.headers["X-Request-Id"] = g.request_id
+        # Deregister when the response is closed, not here — a streamed
+        # response is still synthesizing after this hook returns.
+        response.call_on_close(functools.partial(_unregister_request, g.request_id))
+    # Queue wait and service time are reported separately so a slow turn
+    # can be told apart as "server busy" vs "inference slow".
+    if "queue_wait_ms" in g:
+        response.headers["X-Queue-Wait-Ms"] = f"{g.queue_wait_ms:.1f}"
+        response.headers["X-Service-Ms"] = f"{g.service_ms:.1f}"
+    return response
+
+
+# HuggingFace base URL for Piper voice downloads. Matches what
+# setup.sh and .github/workflows/build.yml use — single source of
+# truth would live in a shared config file, but duplication across
+# three callers is acceptable for a stable upstream path.
+_PIPER_BASE = "https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en"
+# EMBEDDED_OFFLINE=1 turns off every model download: a Piper voice or
+# Whisper model that isn't already on disk fails to load instead. The
+# benchmark harness sets it so no run depends on (or times) the network.
+_OFFLINE = os.environ.get("EMBEDDED_OFFLINE", "0") == "1"
+# url + pinned SHA-256 per file. HTTPS protects the transport; the pin
+# protects against a compromised upstream serving a poisoned model.
+# Hashes computed from the v1.0.0 tag (immutable revision).
+_PIPER_MODELS = {
+    "en_GB-alan-low.onnx": (
+        f"{_PIPER_BASE}/en_GB/alan/low/en_GB-alan-low.onnx",
+        "a1f60584620a2bed203de823d08f5abb336fb15f3d6f33f8c341e3e2cabf5dde",
+    ),
+    "en_GB-alan-low.onnx.json": (
+        f"{_PIPER_BASE}/en_GB/alan/low/en_GB-alan-low.onnx.json",
+        "c8164cc04b6ce102c651ce4a1e788e8429fa638501fca0723860718d4b44637e",
+    ),
+    "en_US-amy-low.onnx": (
+        f"{_PIPER_BASE}/en_US/amy/low/en_US-amy-low.onnx",
+        "a5a91abb7de0f104358a25aded480ddacf1ff0762886325886ec406a2e86aab3",
+    ),
+    "en_US-amy-low.onnx.json": (
+        f"{_PIPER_BASE}/en_US/amy/low/en_US-amy-low.onnx.json",
+        "2250a9a605b8dc35a116717fadc5056695dd809e34a15d02f72a0f52d53d3ebb",
+    ),
+}
+
+
+def _sha256_of(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Model provisioning. Piper voices, and Whisper's ggml models (into
+# pywhispercpp's cache), go through _provision(): files download several
+# at a time, are hashed as they stream, resume from a .part file with an
+# HTTP Range request after an interruption, and are renamed into place
+# only once complete and matching their pin. Each directory keeps a
+# .verified.json of size, mtime and SHA-256 per file, so a later start
+# only re-hashes files that changed. EMBEDDED_MODEL_MIRROR replaces
+# https://huggingface.co in every download URL, for a local mirror or a
+# stand-in server.
+_HF_BASE = "https://huggingface.co"
+_MODEL_MIRROR = os.environ.get("EMBEDDED_MODEL_MIRROR", "").rstrip("/")
+_DOWNLOAD_WORKERS = int(os.environ.get("EMBEDDED_DOWNLOAD_WORKERS", 4))
+_DOWNLOAD_ATTEMPTS = 3
+_DOWNLOAD_CHUNK = 1 << 20
+_VERIFIED_FILENAME = ".verified.json"
+_verified_lock = threading.Lock()
+_provision_locks: Dict[str, threading.Lock] = {}
+
+
+def _model_url(url: str) -> str:
+    if _MODEL_MIRROR and url.startswith(_HF_BASE):
+        return _MODEL_MIRROR + url[len(_HF_BASE):]
+    return url
+
+
+def _read_verified(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, _VERIFIED_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _record_verified(path: str, sha256: str, st: os.stat_result):
+    directory, name = os.path.split(path)
+    with _verified_lock:
+        entries = _read_verified(directory)
+        entries[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+        tmp = os.path.join(directory, f"{_VERIFIED_FILENAME}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(directory, _VERIFIED_FILENAME))
+
+
+def _file_sha256(path: str) -> str:
+    """SHA-256 of a file, taken from .verified.json while its size and mtime are unchanged."""
+    directory, name = os.path.split(path)
+    st = os.stat(path)
+    entry = _read_verified(directory).get(name)
+    if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return entry["sha256"]
+    sha256 = _sha256_of(path)
+    with contextlib.suppress(OSError):  # read-only directory: hash again next time
+        _record_verified(path, sha256, st)
+    return sha256
+
+
+def _download(dest: str, url: str, sha256: Optional[str]) -> str:
+    """Fetch url into dest via dest.part, resuming whatever the .part already holds."""
+    part = f"{dest}.part"
+    h = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(_DOWNLOAD_CHUNK), b""):
+                h.update(chunk)
+                offset += len(chunk)
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # The .part is at least as long as the file, so it can't be trusted.
+        os.remove(part)
+        return _download(dest, url, sha256)
+    started = time.monotonic()
+    with response:
+        if response.status == 206:
+            # Content-Range: bytes <start>-<end>/<total>
+            unit_range, _, total = response.headers.get("Content-Range", "").partition("/")
+            if not unit_range.startswith(f"bytes {offset}-"):
+                raise OSError(f"unexpected Content-Range {unit_range!r} resuming at {offset}")
+            mode = "ab"
+        else:
+            # Nothing to resume, or the server ignored the Range header.
+            h = hashlib.sha256()
+            offset = 0
+            total = response.headers.get("Content-Length", "")
+            mode = "wb"
+        with open(part, mode) as f:
+            for chunk in iter(lambda: response.read(_DOWNLOAD_CHUNK), b""):
+                f.write(chunk)
+                h.update(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    size = os.path.getsize(part)
+    if total.isdigit() and size != int(total):
+        raise OSError(f"connection closed at {size} of {total} bytes")
+    actual = h.hexdigest()
+    if sha256 is not None and actual != sha256:
+        # Poisoned or corrupted: resuming from it would never succeed.
+        os.remove(part)
+        raise ValueError(f"checksum mismatch (expected {sha256}, got {actual})")
+    os.replace(part, dest)
+    _record_verified(dest, actual, os.stat(dest))
+    elapsed = time.monotonic() - started
+    resumed = f", resumed at {offset} bytes" if offset else ""
+    logger.info(f"  → saved {dest} ({size} bytes in {elapsed:.1f}s{resumed}, "
+                f"sha256 {'ok' if sha256 else actual[:16]})")
+    return actual
+
+
+def _provision(dest: str, url: str, sha256: Optional[str] = None) -> str:
+    """Make sure dest holds the file at url and return its SHA-256.
+
+    A file already at dest is kept unless it doesn't match sha256 (when
+    one is pinned). Interrupted downloads are retried from where they
+    stopped; a checksum mismatch is not retried."""
+    with _provision_locks.setdefault(dest, threading.Lock()):
+        if os.path.exists(dest):
+            actual = _file_sha256(dest)
+            if sha256 is None or actual == sha256:
+                return actual
+            logger.warning(f"{dest} does not match its pinned SHA-256, downloading it again")
+        if _OFFLINE:
+            raise RuntimeError(f"{os.path.basename(dest)} is missing and EMBEDDED_OFFLINE is set")
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        logger.info(f"Downloading model file: {os.path.basename(dest)}")
+        for attempt in range(1, _DOWNLOAD_ATTEMPTS + 1):
+            try:
+                return _download(dest, _model_url(url), sha256)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == _DOWNLOAD_ATTEMPTS:
+                    raise
+                logger.warning(f"Download of {os.path.basename(dest)} failed ({e}), retrying")
+                time.sleep(attempt)
+
+
+def _provision_piper_models():
+    """Self-heal: make sure the bundled Piper voices are in models/ and
+    match their pins, downloading any that aren't before voices load.
+
+    This is a runtime safety net for dev environments where setup.sh
+    was skipped or ran before the download step existed. In a packaged
+    release the models are bundled via PyInstaller --add-data so this
+    block is a no-op."""
+    # Don't try to download in a PyInstaller bundle — models ship inside.
+    if hasattr(sys, "_MEIPASS"):
+        return
+
+    def fetch(item: Tuple[str, Tuple[str, str]]):
+        filename, (url, expected_sha256) = item
+        try:
+            _provision(os.path.join(_MODELS_DIR, filename), url, expected_sha256)
+        except Exception as e:
+            # A partial download stays as .part for the next attempt.
+            logger.error(f"  ✗ could not provision {filename}: {e}")
+
+    with ThreadPoolExecutor(max_workers=_DOWNLOAD_WORKERS, thread_name_prefix="download") as pool:
+        list(pool.map(fetch, _PIPER_MODELS.items()))
+
+
+# Model loading. main() binds the port straight away and loads every
+# component concurrently in the background, so the Electron shell's
+# /health poll succeeds immediately and reports per-component progress
+# instead of waiting on a serial Alan → Amy → Whisper load. Components
+# named in EMBEDDED_LAZY_LOAD (e.g. "whisper" or "alan,amy") aren't
+# loaded until a request first needs them. Requests that arrive while a
+# component is loading wait for it rather than failing.
+class _Component:
+    """Load state (pending → loading → warming → ready | failed) for one model.
+
+    The loader returns the loaded model (falsy on failure); pooled
+    components can be unloaded back to pending and reloaded later."""
+
+    def __init__(self, name: str, loader, warmup=None, size_bytes: int = 0):
+        self.name = name
+        self._loader = loader
+        self._warmup = warmup
+        self.size_bytes = size_bytes
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self.state = "pending"
+        self.value = None
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        self.last_used = 0.0
+
+    def start(self):
+        """Begin loading in the background (no-op unless pending)."""
+        with self._lock:
+            if self.state != "pending":
+                return
+            self.state = "loading"
+            self._done.clear()
+        threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Start loading if needed, wait for it, and return the model (None if unavailable)."""
+        deadline = time.monotonic() + (timeout if timeout is not None else _LOAD_WAIT_S)
+        while True:
+            self.start()
+            if not self._done.wait(max(0.0, deadline - time.monotonic())):
+                return None
+            with self._lock:
+                if self.state == "ready":
+                    self.last_used = time.monotonic()
+                    return self.value
+                if self.state == "failed":
+                    return None
+            # Unloaded between load and wake-up — go round again.
+
+    def ensure(self, timeout: Optional[float] = None) -> bool:
+        """Start loading if needed and wait for it. True once ready."""
+        return self.acquire(timeout) is not None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def unload(self) -> bool:
+        """Drop the loaded model. In-flight users keep their reference
+        until they finish; the memory goes when the last one does."""
+        with self._lock:
+            if self.state != "ready":
+                return False
+            self.state = "pending"
+            self.value = None
+            self._done.clear()
+        return True
+
+    def to_dict(self) -> dict:
+        info = {"state": self.state}
+        if self.load_ms is not None:
+            info["load_ms"] = round(self.load_ms)
+        if self.warmup_ms is not None:
+            info["warmup_ms"] = round(self.warmup_ms)
+        return info
+
+    def _load(self):
+        logger.info(f"Loading {self.name}...")
+        started = time.monotonic()
+        try:
+            value = self._loader()
+        except Exception as e:
+            logger.error(f"Failed to load {self.name}: {e}")
+            value = None
+        self.load_ms = (time.monotonic() - started) * 1000
+        if value and self._warmup is not None:
+            # The first inference after load pays for ONNX Runtime /
+            # whisper.cpp graph setup, buffer allocation and paging the
+            # weights in. Pay it here, before the component reports
+            # ready, so the learner's first Turn runs at steady state.
+            self.state = "warming"
+            warm_started = time.monotonic()
+            try:
+                self._warmup(value)
+            except Exception as e:
+                logger.warning(f"Warmup of {self.name} failed (continuing): {e}")
+            self.warmup_ms = (time.monotonic() - warm_started) * 1000
+        with self._lock:
+            self.value = value or None
+            self.state = "ready" if value else "failed"
+            self.last_used = time.monotonic()
+        logger.info(f"{self.name} {self.state} after {(time.monotonic() - started) * 1000:.0f} ms")
+        self._done.set()
+
+
+class _ModelPool:
+    """Models loaded on demand and unloaded least-recently-used first
+    once their estimated resident size would exceed a byte budget
+    (0 = unbounded)."""
+
+    def __init__(self, kind: str, memory_bytes: int):
+        self.kind = kind
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Component] = {}
+        self.pinned: set = set()  # keys never unloaded to make room
+        self.evictions = 0
+
+    def components(self) -> List[_Component]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def component(self, key: str) -> Optional[_Component]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def resident_bytes(self) -> int:
+        return sum(c.size_bytes for c in self.components() if c.state in ("loading", "warming", "ready"))
+
+    def _add(self, key: str, loader, warmup, size_bytes: int) -> _Component:
+        def load():
+            self._make_room(key, size_bytes)
+            return loader()
+
+        component = _Component(f"{self.kind}:{key}", load, warmup, size_bytes)
+        with self._lock:
+            self._entries[key] = component
+        return component
+
+    def _make_room(self, key: str, size_bytes: int):
+        if self.memory_bytes <= 0:
+            return
+        with self._lock:
+            others = [c for k, c in self._entries.items()
+                      if k != key and k not in self.pinned and c.state == "ready"]
+        resident = sum(c.size_bytes for c in self.components()
+                       if c.state in ("loading", "warming", "ready") and c.name != f"{self.kind}:{key}")
+        for victim in sorted(others, key=lambda c: c.last_used):
+            if resident + size_bytes <= self.memory_bytes:
+                break
+            if victim.unload():
+                resident -= victim.size_bytes
+                with self._lock:
+                    self.evictions += 1
+                logger.info(f"Unloaded {victim.name} to stay within the {self.kind} memory budget")
+                self._unloaded(victim.name[len(self.kind) + 1:])
+
+    def _unloaded(self, key: str):
+        """Hook for pools whose models live outside this process."""
+
+    def stats(self) -> dict:
+        return {
+            "resident_bytes": self.resident_bytes(),
+            "memory_budget_bytes": self.memory_bytes,
+            "evictions": self.evictions,
+        }
+
+
+# Inference threads. ONNX Runtime and whisper.cpp each size their thread
+# pools to the whole machine, so a synthesis overlapping a transcription
+# runs twice as many busy threads as there are cores. By default the
+# cores this process may run on (its affinity mask, which is what a
+# container or taskset actually grants) are split between the two:
+# EMBEDDED_TTS_THREADS and EMBEDDED_WHISPER_THREADS override either side.
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        return os.cpu_count() or 1
+
+
+_CPUS = _available_cpus()
+_TTS_CPU_SHARE = max(1, _CPUS // 2)
+_STT_CPU_SHARE = max(1, _CPUS - _CPUS // 2)
+
+
+def _tts_threads() -> Tuple[int, int]:
+    """(intra-op, inter-op) ONNX Runtime threads for each Piper session.
+
+    Intra-op threads split the TTS share between the scheduler's workers,
+    which may synthesize at the same time. Piper's graph is one chain of
+    ops, so inter-op parallelism rarely helps and defaults to off."""
+    intra = os.environ.get("EMBEDDED_TTS_THREADS")
+    inter = os.environ.get("EMBEDDED_TTS_INTER_THREADS")
+    return (int(intra) if intra else max(1, _TTS_CPU_SHARE // tts_scheduler.workers),
+            int(inter) if inter else 1)
+
+
+# Voice registry. Every Piper voice in models/ (an .onnx file with its
+# .onnx.json config) is discovered at startup and listed by /v1/voices
+# and /v1/models. Voices load on first request and are unloaded LRU
+# under EMBEDDED_VOICE_MEMORY_MB, so shipping more accents doesn't
+# multiply resident memory. The default male/female voices (Alan and
+# Amy unless overridden) are what "male"/"female" requests resolve to,
+# and the ones loaded eagerly at startup.
+_MODELS_DIR = "models"
+# ONNX Runtime optimizes a voice's graph every time it builds a session
+# for it. The optimized graph is saved here on first load, named by the
+# model's SHA-256 and the ORT version, and loaded as-is afterwards. Set
+# EMBEDDED_TTS_GRAPH_CACHE_DIR to "" to optimize on every load instead.
+# A one-file PyInstaller build unpacks models/ somewhere new on every run,
+# so there it is off unless pointed at a persistent directory.
+_TTS_GRAPH_CACHE_DIR = os.environ.get(
+    "EMBEDDED_TTS_GRAPH_CACHE_DIR",
+    "" if hasattr(sys, "_MEIPASS") else os.path.join(_MODELS_DIR, ".optimized"),
+)
+
+# Piper configs don't record speaker gender, so the voices we know about
+# are listed here; a custom voice can also declare "gender" in its
+# .onnx.json. Anything else is categorized as "unknown".
+_VOICE_GENDERS = {"alan": "male", "amy": "female"}
+_VOICE_DISPLAY_NAMES = {"alan": "Alan (British Male)", "amy": "Amy (American Female)"}
+
+
+class _VoiceInfo:
+    def __init__(self, key: str, voice_id: int, config: dict, model_path: str):
+        language = config.get("language") or {}
+        parts = key.split("-")
+        self.key = key
+        self.id = voice_id
+        self.model_path = model_path
+        self.speaker = str(config.get("dataset") or (parts[1] if len(parts) > 1 else key)).lower()
+        self.language = language.get("code") or parts[0]
+        self.quality = (config.get("audio") or {}).get("quality") or (parts[2] if len(parts) > 2 else "")
+        self.gender = config.get("gender") or _VOICE_GENDERS.get(self.speaker, "unknown")
+        self.display_name = _VOICE_DISPLAY_NAMES.get(self.speaker) or (
+            f"{self.speaker.title()} ({self.language}"
+            + (f" {self.gender.title()})" if self.gender != "unknown" else ")")
+        )
+        pinned = _PIPER_MODELS.get(os.path.basename(model_path))
+        # Unpinned voices are hashed on first load (for the TTS cache key).
+        self.sha256: Optional[str] = pinned[1] if pinned else None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "key": self.key,
+            "name": self.display_name,
+            "gender": self.gender,
+            "language": self.language,
+        }
+
+
+class _VoiceRegistry(_ModelPool):
+    def __init__(self, models_dir: str, memory_bytes: int):
+        super().__init__("voice", memory_bytes)
+        self.models_dir = models_dir
+        self.voices: Dict[str, _VoiceInfo] = {}
+        # Set by the first refresh(), which runs once the bundled voices
+        # are provisioned (downloaded or verified).
+        self.discovered = threading.Event()
+
+    def refresh(self):
+        """Discover .onnx/.onnx.json pairs. Known voices keep their IDs."""
+        try:
+            filenames = sorted(os.listdir(self.models_dir))
+        except OSError:
+            filenames = []
+        # The bundled voices come first so Alan and Amy keep IDs 0 and 1.
+        filenames.sort(key=lambda f: (f not in _PIPER_MODELS, f))
+        for filename in filenames:
+            if not filename.endswith(".onnx") or f"{filename}.json" not in filenames:
+                continue
+            key = filename[:-len(".onnx")]
+            if key in self.voices:
+                continue
+            model_path = os.path.join(self.models_dir, filename)
+            try:
+                with open(f"{model_path}.json", "r", encoding="utf-8") as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping voice {filename}: unreadable config ({e})")
+                continue
+            info = _VoiceInfo(key, len(self.voices), config, model_path)
+            self.voices[key] = info
+            self._add(key, functools.partial(self._load_voice, info), _warm_up_voice,
+                      os.path.getsize(model_path))
+        logger.info(f"Voice registry: {len(self.voices)} voice(s) in {self.models_dir}/")
+        self.discovered.set()
+
+    def default_voice(self, gender: str) -> Optional[_VoiceInfo]:
+        preferred = os.environ.get(f"EMBEDDED_DEFAULT_{gender.upper()}_VOICE",
+                                   "en_GB-alan-low" if gender == "male" else "en_US-amy-low")
+        if preferred in self.voices:
+            return self.voices[preferred]
+        matches = [v for v in self.voices.values() if v.gender == gender]
+        return matches[0] if matches else next(iter(self.voices.values()), None)
+
+    def default_voices(self) -> List[_VoiceInfo]:
+        defaults = []
+        for gender in ("male", "female"):
+            info = self.default_voice(gender)
+            if info is not None and info not in defaults:
+                defaults.append(info)
+        return defaults
+
+    def resolve(self, voice: Optional[str], voice_id: Optional[int] = None) -> Optional[_VoiceInfo]:
+        """Map a request's voice/voice_id onto a registered voice."""
+        if voice_id is not None:
+            for info in self.voices.values():
+                if info.id == voice_id:
+                    return info
+        name = (voice or "").strip().lower()
+        if name == "random":
+            defaults = self.default_voices()
+            return random.choice(defaults) if defaults else None
+        for info in self.voices.values():
+            if info.key.lower() == name or info.speaker == name:
+                return info
+        # "female" contains "male", so test it first.
+        if "female" in name:
+            return self.default_voice("female")
+        if "male" in name:
+            return self.default_voice("male")
+        # Default to the female voice (Amy) for anything else
+        return self.default_voice("female")
+
+    def load(self, info: _VoiceInfo, timeout: Optional[float] = None) -> Optional[PiperVoice]:
+        return self.component(info.key).acquire(timeout)
+
+    def categorize(self) -> dict:
+        categories = {"male": [], "female": [], "unknown": []}
+        for info in self.voices.values():
+            categories.get(info.gender, categories["unknown"]).append(info.to_dict())
+        categories["all"] = [info.to_dict() for info in self.voices.values()]
+        return categories
+
+    def _load_voice(self, info: _VoiceInfo) -> PiperVoice:
+        if info.sha256 is None:
+            info.sha256 = _file_sha256(info.model_path)
+        with open(f"{info.model_path}.json", "r", encoding="utf-8") as f:
+            config = PiperConfig.from_dict(json.load(f))
+        voice = PiperVoice(config=config, session=self._create_session(info))
+        logger.info(f"Loaded {info.display_name} voice successfully")
+        return voice
+
+    @staticmethod
+    def _session_options() -> onnxruntime.SessionOptions:
+        intra, inter = _tts_threads()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra
+        options.inter_op_num_threads = inter
+        options.execution_mode = (onnxruntime.ExecutionMode.ORT_PARALLEL if inter > 1
+                                  else onnxruntime.ExecutionMode.ORT_SEQUENTIAL)
+        # ENABLE_ALL adds layout rewrites tuned to this CPU, which ORT warns
+        # against saving; EXTENDED keeps the cached graph portable.
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        return options
+
+    def _create_session(self, info: _VoiceInfo) -> onnxruntime.InferenceSession:
+        """The voice's ONNX Runtime session, from its optimized graph when one is cached."""
+        providers = ["CPUExecutionProvider"]
+        cached = None
+        if _TTS_GRAPH_CACHE_DIR:
+            cached = os.path.join(_TTS_GRAPH_CACHE_DIR,
+                                  f"{info.key}.{info.sha256[:16]}.ort-{onnxruntime.__version__}.onnx")
+        if cached and os.path.exists(cached):
+            options = self._session_options()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                return onnxruntime.InferenceSession(cached, sess_options=options, providers=providers)
+            except Exception as e:  # truncated, or written by a different build
+                logger.warning(f"Discarding optimized graph {cached}: {e}")
+                with contextlib.suppress(OSError):
+                    os.remove(cached)
+
+        options = self._session_options()
+        partial = None
+        if cached:
+            with contextlib.suppress(OSError):
+                os.makedirs(_TTS_GRAPH_CACHE_DIR, exist_ok=True)
+            if os.access(_TTS_GRAPH_CACHE_DIR, os.W_OK):
+                # Written under a temporary name so a crash mid-write (or a
+                # second process loading the same voice) never leaves a
+                # partial graph where the next start would load it.
+                partial = f"{cached}.{os.getpid()}.part"
+                options.optimized_model_filepath = partial
+        try:
+            session = onnxruntime.InferenceSession(info.model_path, sess_options=options, providers=providers)
+            if partial:
+                try:
+                    os.replace(partial, cached)
+                except OSError as e:
+                    logger.debug(f"Could not cache optimized graph for {info.key}: {e}")
+        finally:
+            if partial:
+                with contextlib.suppress(OSError):
+                    os.remove(partial)  # left behind only if the load or the rename failed
+        return session
+
+
+voice_registry = _VoiceRegistry(
+    _MODELS_DIR,
+    memory_bytes=int(float(os.environ.get("EMBEDDED_VOICE_MEMORY_MB", 256)) * 1024 * 1024),
+)
+
+
+def categorize_voices():
+    """Return discovered Piper voices grouped by gender"""
+    return voice_registry.categorize()
+
+
+def _warm_up_voice(voice: PiperVoice):
+    _synthesize_pcm(voice, "Hello, warming up.", 1.0)
+
+
+# Whisper model pool. Transcription requests pick a model with the
+# OpenAI `model` form field ("tiny", "base-q5_1", "whisper-small", ...;
+# "whisper-1" or no model means EMBEDDED_WHISPER_MODEL). Models listed
+# in EMBEDDED_WHISPER_RESIDENT load at startup and stay loaded; any other
+# allowed model loads on first use and is unloaded least-recently-used
+# under EMBEDDED_WHISPER_MEMORY_MB. Each model has its own lock — a
+# whisper.cpp context can't be shared across threads, but two different
+# models can run side by side.
+_WHISPER_MODEL_MB = {"tiny": 75, "base": 142, "small": 466, "medium": 1500, "large": 2900}
+_WHISPER_QUANT_RATIO = {"q5_0": 0.36, "q5_1": 0.38, "q8_0": 0.55}
+
+
+def _whisper_model_bytes(name: str) -> int:
+    """Approximate resident size, for the pool's memory budget."""
+    size = name.split("-")[0].split(".")[0]  # small.en-q5_1 → small
+    quant = name.rsplit("-", 1)[-1]
+    mb = _WHISPER_MODEL_MB.get(size, 500) * _WHISPER_QUANT_RATIO.get(quant, 1.0)
+    return int(mb * 1024 * 1024)
+
+
+def _whisper_threads(name: str) -> Optional[int]:
+    """EMBEDDED_WHISPER_THREADS_<MODEL> (e.g. _SMALL_Q5_1), else EMBEDDED_WHISPER_THREADS."""
+    per_model = "EMBEDDED_WHISPER_THREADS_" + "".join(c if c.isalnum() else "_" for c in name.upper())
+    value = os.environ.get(per_model) or os.environ.get("EMBEDDED_WHISPER_THREADS")
+    return int(value) if value else None  # None → min(4, STT share of the cores)
+
+
+def _whisper_model_dir(name: str) -> str:
+    # Running from PyInstaller bundle: use the bundled model if this is it
+    if hasattr(sys, '_MEIPASS'):
+        bundled = os.path.join(sys._MEIPASS, 'whisper-models')
+        if os.path.exists(os.path.join(bundled, f'ggml-{name}.bin')):
+            logger.info(f"Using bundled whisper model: ggml-{name}.bin")
+            return bundled
+    # pywhispercpp's own cache, provisioned like the Piper voices (no pinned
+    # hash: the upstream path tracks a branch, not a fixed revision).
+    from pywhispercpp.constants import MODELS_BASE_URL, MODELS_DIR, MODELS_PREFIX_URL
+    _provision(os.path.join(MODELS_DIR, f"ggml-{name}.bin"), f"{MODELS_BASE_URL}/{MODELS_PREFIX_URL}-{name}.bin")
+    return str(MODELS_DIR)
+
+
+class _WhisperPool(_ModelPool):
+    def __init__(self, names: List[str], default: str, resident: List[str], memory_bytes: int):
+        super().__init__("whisper", memory_bytes)
+        self.names = [name for name in names if name in WHISPER_MODELS]
+        unknown = sorted(set(names) - set(self.names))
+        if unknown:
+            logger.warning(f"Ignoring unknown Whisper model(s): {', '.join(unknown)}")
+        if default not in self.names:
+            self.names.insert(0, default)
+        self.default = default
+        self.pinned = {name for name in [default] + resident if name in self.names}
+        self._locks: Dict[str, threading.Lock] = {}
+        for name in self.names:
+            self._locks[name] = threading.Lock()
+            self._add(name, functools.partial(self._load_model, name),
+                      functools.partial(self._warm_up, name), _whisper_model_bytes(name))
+
+    def resolve(self, model: Optional[str]) -> Optional[str]:
+        """Map a request's model field onto an allowed model name (None if not allowed)."""
+        if model is not None and not isinstance(model, str):
+            return None
+        name = (model or "").strip().lower()
+        if name in ("", "whisper", "whisper-1"):
+            return self.default
+        if name.startswith("whisper-"):
+            name = name[len("whisper-"):]
+        return name if name in self._locks else None
+
+    def acquire(self, name: str, timeout: Optional[float] = None) -> Optional[WhisperModel]:
+        return self.component(name).acquire(timeout)
+
+    def lock(self, name: str):
+        if stt_processes is not None:
+            # Each worker process has its own copy and takes one job at a time.
+            return contextlib.nullcontext()
+        return self._locks[name]
+
+    def _load_model(self, name: str):
+        params = {}
+        threads = _whisper_threads(name)
+        if threads:
+            params["n_threads"] = threads
+        elif stt_processes is None:
+            params["n_threads"] = min(4, _STT_CPU_SHARE)
+        if stt_processes is not None:
+            return stt_processes.load(name, _whisper_model_dir(name), params)
+        logger.info(f"Loading Whisper {name} model (this may take a moment)...")
+        # Using pywhispercpp which is much lighter than openai-whisper
+        model = WhisperModel(name, models_dir=_whisper_model_dir(name), **params)
+        logger.info(f"Whisper {name} model loaded successfully")
+        return model
+
+    def _unloaded(self, key: str):
+        if stt_processes is not None:
+            stt_processes.unload(key)
+
+    def _warm_up(self, name: str, model: WhisperModel):
+        if stt_processes is not None:
+            return  # each worker warms its copy up as it loads it
+        # One second of low-level noise rather than digital silence, so the
+        # decoder actually runs instead of bailing out on an empty mel.
+        audio = (np.random.default_rng(0).standard_normal(_WHISPER_SAMPLE_RATE) * 1e-3).astype(np.float32)
+        with self.lock(name):
+            model.transcribe(audio)
+
+
+# Multi-core STT. One whisper.cpp context transcribes one utterance at a
+# time, and a single model per process can't use more of the machine
+# than its n_threads. With EMBEDDED_STT_PROCESSES=N the Whisper pool's
+# models live in N worker processes instead, each holding its own copy.
+# Jobs go to the least-loaded worker, and the audio travels through a
+# per-worker shared-memory buffer rather than being pickled down the pipe.
+_STT_PROCESSES = int(os.environ.get("EMBEDDED_STT_PROCESSES", 0))
+_SHM_INITIAL_SECONDS = 30
+
+
+def _whisper_process_main(conn, abort):
+    """Worker process loop: load / unload / transcribe requests from the server."""
+    models = {}
+    shm = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        op, args = message[0], message[1:]
+        try:
+            if op == "load":
+                name, models_dir, params = args
+                if name not in models:
+                    models[name] = WhisperModel(name, models_dir=models_dir, **params)
+                    # See _WhisperPool._warm_up.
+                    noise = (np.random.default_rng(0).standard_normal(_WHISPER_SAMPLE_RATE) * 1e-3).astype(np.float32)
+                    models[name].transcribe(noise)
+                result = None
+            elif op == "unload":
+                models.pop(args[0], None)
+                result = None
+            elif op == "transcribe":
+                name, models_dir, params, shm_name, n_samples = args
+                if name not in models:  # respawned since the model was loaded
+                    models[name] = WhisperModel(name, models_dir=models_dir, **params)
+                if shm is None or shm.name != shm_name:
+                    if shm is not None:
+                        shm.close()
+                    # Spawned workers share the server's resource tracker,
+                    # so attaching doesn't take over ownership of the segment.
+                    shm = shared_memory.SharedMemory(name=shm_name)
+                audio = np.ndarray((n_samples,), dtype=np.float32, buffer=shm.buf)
+                try:
+                    segments = models[name].transcribe(audio, abort_callback=abort.is_set)
+                finally:
+                    del audio  # the buffer can't be closed while a view exists
+                result = [(seg.t0, seg.t1, seg.text) for seg in segments]
+            else:
+                raise ValueError(f"unknown operation {op!r}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    if shm is not None:
+        shm.close()
+
+
+class _Segment:
+    def __init__(self, t0: int, t1: int, text: str):
+        self.t0 = t0
+        self.t1 = t1
+        self.text = text
+
+
+class _WhisperProcess:
+    """One worker process and the shared-memory buffer that feeds it."""
+
+    def __init__(self, index: int, context):
+        self.index = index
+        self._context = context
+        self.lock = threading.Lock()  # one job (or load) at a time
+        self.outstanding = 0  # jobs routed here, running or waiting on the lock
+        self.completed = 0
+        self.restarts = 0
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._start()
+
+    def _start(self):
+        self.conn, child_conn = self._context.Pipe()
+        self.abort = self._context.Event()
+        self.process = self._context.Process(
+            target=_whisper_process_main, args=(child_conn, self.abort),
+            name=f"stt-worker-{self.index}", daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def call(self, message: tuple, abort_callback=None):
+        """Send one request and wait for its reply. Caller holds self.lock."""
+        if not self.process.is_alive():
+            logger.warning(f"STT worker {self.index} exited (code {self.process.exitcode}); restarting")
+            self.conn.close()
+            self.restarts += 1
+            self._start()
+        self.abort.clear()
+        self.conn.send(message)
+        while not self.conn.poll(0.05):
+            if abort_callback is not None and abort_callback():
+                self.abort.set()  # whisper.cpp checks it between decoder steps
+            if not self.process.is_alive():
+                raise RuntimeError(f"STT worker {self.index} died (code {self.process.exitcode})")
+        status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"STT worker {self.index}: {result}")
+        return result
+
+    def buffer_for(self, audio: np.ndarray) -> shared_memory.SharedMemory:
+        """Copy audio into this worker's shared buffer, growing it if needed."""
+        if self._shm is None or self._shm.size < audio.nbytes:
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+            size = max(audio.nbytes, _SHM_INITIAL_SECONDS * _WHISPER_SAMPLE_RATE * 4)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        np.ndarray(audio.shape, dtype=np.float32, buffer=self._shm.buf)[:] = audio
+        return self._shm
+
+    def close(self):
+        self.conn.close()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+
+
+class _RemoteWhisper:
+    """Stands in for a WhisperModel whose copies live in the worker processes."""
+
+    def __init__(self, pool: "_WhisperProcessPool", name: str, models_dir: Optional[str], params: dict):
+        self._pool = pool
+        self.name = name
+        self.models_dir = models_dir
+        self.params = params
+
+    def transcribe(self, audio: np.ndarray, abort_callback=None) -> List[_Segment]:
+        return self._pool.transcribe(self, audio, abort_callback)
+
+
+class _WhisperProcessPool:
+    def __init__(self, processes: int):
+        # spawn everywhere: fork would copy the server's threads and locks
+        # mid-flight, and macOS/Windows (and PyInstaller builds) spawn anyway.
+        context = multiprocessing.get_context("spawn")
+        self.workers = [_WhisperProcess(i, context) for i in range(processes)]
+        self._lock = threading.Lock()
+        logger.info(f"Started {processes} STT worker process(es)")
+
+    def load(self, name: str, models_dir: str, params: dict) -> _RemoteWhisper:
+        if "n_threads" not in params:
+            # Split the STT share between the workers instead of each taking min(4, cores).
+            params = dict(params, n_threads=max(1, _STT_CPU_SHARE // len(self.workers)))
+        logger.info(f"Loading Whisper {name} model in {len(self.workers)} worker process(es)...")
+        errors = []
+
+        def load_into(worker: _WhisperProcess):
+            try:
+                with worker.lock:
+                    worker.call(("load", name, models_dir, params))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load_into, args=(w,)) for w in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        logger.info(f"Whisper {name} model loaded successfully")
+        return _RemoteWhisper(self, name, models_dir, params)
+
+    def unload(self, name: str):
+        for worker in self.workers:
+            try:
+                with worker.lock:
+                    worker.call(("unload", name))
+            except Exception as e:
+                logger.warning(f"STT worker {worker.index}: unload of {name} failed: {e}")
+
+    def transcribe(self, model: _RemoteWhisper, audio: np.ndarray, abort_callback=None) -> List[_Segment]:
+        with self._lock:
+            worker = min(self.workers, key=lambda w: w.outstanding)
+            worker.outstanding += 1
+        try:
+            with worker.lock:
+                shm = worker.buffer_for(np.ascontiguousarray(audio, dtype=np.float32))
+                result = worker.call(
+                    ("transcribe", model.name, model.models_dir, model.params, shm.name, len(audio)),
+                    abort_callback,
+                )
+                worker.completed += 1
+        finally:
+            with self._lock:
+                worker.outstanding -= 1
+        return [_Segment(*segment) for segment in result]
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [{
+                "pid": w.process.pid,
+                "alive": w.process.is_alive(),
+                "outstanding": w.outstanding,
+                "completed": w.completed,
+                "restarts": w.restarts,
+            } for w in self.workers]
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+# Started by main() only — spawned workers re-import this module and
+# must not start pools of their own.
+stt_processes: Optional[_WhisperProcessPool] = None
+
+
+def _env_list(name: str, default: str) -> List[str]:
+    return [item.strip().lower() for item in os.environ.get(name, default).split(",") if item.strip()]
+
+
+_WHISPER_DEFAULT_MODEL = os.environ.get("EMBEDDED_WHISPER_MODEL", "tiny").strip().lower()
+whisper_pool = _WhisperPool(
+    _env_list("EMBEDDED_WHISPER_MODELS", ",".join(
+        name for name in WHISPER_MODELS if name.split("-")[0].split(".")[0] in ("tiny", "base", "small"))),
+    default=_WHISPER_DEFAULT_MODEL,
+    resident=_env_list("EMBEDDED_WHISPER_RESIDENT", _WHISPER_DEFAULT_MODEL),
+    memory_bytes=int(float(os.environ.get("EMBEDDED_WHISPER_MEMORY_MB", 1024)) * 1024 * 1024),
+)
+
+
+_LOAD_WAIT_S = float(os.environ.get("EMBEDDED_LOAD_WAIT_S", 120))
+_LAZY_LOAD = {name.strip() for name in os.environ.get("EMBEDDED_LAZY_LOAD", "").lower().split(",") if name.strip()}
+
+
+def _is_lazy(name: str) -> bool:
+    if "all" in _LAZY_LOAD or name in _LAZY_LOAD:
+        return True
+    if name in whisper_pool.names:
+        return "stt" in _LAZY_LOAD or "whisper" in _LAZY_LOAD
+    info = voice_registry.voices.get(name)
+    return info is not None and ("tts" in _LAZY_LOAD or info.speaker in _LAZY_LOAD)
+
+
+def _all_components() -> Dict[str, _Component]:
+    components = {c.name: c for c in voice_registry.components()}
+    components.update({c.name: c for c in whisper_pool.components()})
+    return components
+
+
+def _component_usable(component: _Component, lazy: bool) -> bool:
+    """Ready, or loadable on demand (lazy, or unloaded after a successful load)."""
+    if component.state == "ready":
+        return True
+    return component.state == "pending" and (lazy or component.load_ms is not None)
+
+
+def _stt_usable() -> bool:
+    return _component_usable(whisper_pool.component(whisper_pool.default), _is_lazy(whisper_pool.default))
+
+
+def _tts_usable() -> bool:
+    defaults = voice_registry.default_voices()
+    return bool(defaults) and all(
+        _component_usable(voice_registry.component(info.key), _is_lazy(info.key)) for info in defaults
+    )
+
+
+def _start_background_loading():
+    """Kick off every non-lazy component at once and log time-to-ready."""
+    started = time.monotonic()
+    eager = [whisper_pool.component(name) for name in sorted(whisper_pool.pinned) if not _is_lazy(name)]
+    if not eager:
+        logger.info("Lazy-loading whisper on first use")
+    for component in eager:
+        component.start()
+
+    def load_voices():
+        try:
+            # Runtime self-heal — download any missing model files first.
+            _provision_piper_models()
+        finally:
+            voice_registry.refresh()  # requests waiting on discovery go ahead
+        voices = [voice_registry.component(info.key) for info in voice_registry.default_voices()
+                  if not _is_lazy(info.key)]
+        for component in voices:
+            component.start()
+        return voices
+
+    def report():
+        eager.extend(load_voices())
+        for component in eager:
+            component.wait()
+        failed = [c.name for c in eager if c.state != "ready"]
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if failed:
+            logger.warning(f"Startup finished in {elapsed_ms:.0f} ms; failed to load: {', '.join(failed)}")
+        else:
+            logger.info(f"All eagerly loaded components ready in {elapsed_ms:.0f} ms")
+
+    threading.Thread(target=report, name="startup-report", daemon=True).start()
+
+
+# Inference scheduling. Flask serves requests on threads, but there is
+# one Whisper context and one ONNX session per voice. Every engine call
+# goes through a per-engine scheduler: a bounded queue drained by a
+# fixed number of worker threads. A full queue rejects immediately
+# (429) instead of letting latency grow without bound, and a job still
+# queued when its timeout passes is dropped (503) rather than run for
+# a client that has already given up.
+class _SchedulerError(Exception):
+    status = 503
+
+
+class _QueueFull(_SchedulerError):
+    status = 429
+
+
+class _DeadlineExceeded(_SchedulerError):
+    status = 503
+
+
+class _Cancelled(_SchedulerError):
+    # Nobody is listening by the time this is sent; 499 ("client closed
+    # request") just keeps it distinguishable in logs.
+    status = 499
+
+
+# Barge-in: when a learner interrupts, the client aborts its fetch and
+# calls DELETE /v1/requests/<id>. The request's _CancelToken drops its
+# queued jobs, aborts Whisper mid-inference and stops Piper at the next
+# sentence, so the worker is free for the next Turn straight away.
+class _CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, _CancelToken] = {}
+
+# Engine functions run on scheduler workers; the worker exposes the
+# current job's token here so they can stop early.
+_worker_local = threading.local()
+
+
+def _job_cancel_token() -> _CancelToken:
+    return getattr(_worker_local, "cancel", None) or _CancelToken()
+
+
+def _request_cancel_token() -> Optional[_CancelToken]:
+    return g.get("cancel") if has_request_context() else None
+
+
+class _Job:
+    def __init__(self, fn, args, timeout: float, cancel: Optional[_CancelToken]):
+        self.fn = fn
+        self.args = args
+        self.cancel = cancel
+        self.trace = _current_trace()
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + timeout
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.abandoned = False
+        self.done = threading.Event()
+
+    @property
+    def queue_wait_ms(self) -> float:
+        return ((self.started or time.monotonic()) - self.enqueued) * 1000
+
+    @property
+    def service_ms(self) -> float:
+        if self.started is None:
+            return 0.0
+        return ((self.finished or time.monotonic()) - self.started) * 1000
+
+
+class _InferenceScheduler:
+    """Bounded work queue + worker threads in front of one inference engine."""
+
+    def __init__(self, name: str, workers: int, max_queue: int, timeout_s: float):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.timeout_s = timeout_s
+        # Unbounded: capacity is enforced under _lock, where slots reserved
+        # by admit() count against max_queue alongside queued jobs.
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self._active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.cancelled = 0
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"{name}-worker-{i}", daemon=True).start()
+
+    def admit(self) -> "_Reservation":
+        """Reserve a queue slot now, or fail fast (e.g. before a stream's headers go out).
+
+        The slot is used by the first run() passed the reservation; until
+        then, or until release(), no other job can take it."""
+        with self._lock:
+            if self._queue.qsize() + self._reserved >= self.max_queue:
+                self.rejected += 1
+                raise _QueueFull(f"{self.name} queue is full ({self.max_queue} waiting)")
+            self._reserved += 1
+        return _Reservation(self)
+
+    def release(self, reservation: "_Reservation"):
+        with self._lock:
+            if reservation.held:
+                reservation.held = False
+                self._reserved -= 1
+
+    def run(self, fn, *args, timeout: Optional[float] = None, cancel: Optional[_CancelToken] = None,
+            reservation: Optional["_Reservation"] = None):
+        """Queue fn(*args), block until it finishes, and return its result.
+
+        `cancel` defaults to the current request's token."""
+        if cancel is None:
+            cancel = _request_cancel_token()
+        if cancel is not None and cancel.cancelled:
+            raise _Cancelled(f"{self.name} request was cancelled")
+        job = _Job(fn, args, timeout if timeout is not None else self.timeout_s, cancel)
+        with self._lock:
+            if reservation is not None and reservation.held:
+                reservation.held = False
+                self._reserved -= 1
+            elif self._queue.qsize() + self._reserved >= self.max_queue:
+                self.rejected += 1
+                raise _QueueFull(f"{self.name} queue is full ({self.max_queue} waiting)")
+            self._queue.put_nowait(job)
+        if cancel is not None:
+            cancel.on_cancel(job.done.set)  # wake the waiting request thread
+
+        finished = job.done.wait(max(0.0, job.deadline - time.monotonic()))
+        if cancel is not None and cancel.cancelled:
+            job.abandoned = True
+            with self._lock:
+                self.cancelled += 1
+            raise _Cancelled(f"{self.name} request was cancelled")
+        if not finished or job.started is None:
+            job.abandoned = True
+            with self._lock:
+                self.expired += 1
+            _queue_wait_seconds.observe(job.queue_wait_ms / 1000, self.name)
+            raise _DeadlineExceeded(
+                f"{self.name} request timed out (queued {job.queue_wait_ms:.0f} ms, "
+                f"service {job.service_ms:.0f} ms)"
+            )
+
+        _record_job_timing(self.name, job)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": self._queue.qsize(),
+                "reserved": self._reserved,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "cancelled": self.cancelled,
+            }
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            cancelled = job.cancel is not None and job.cancel.cancelled
+            if job.abandoned or cancelled or time.monotonic() > job.deadline:
+                job.done.set()
+                continue
+            with self._lock:
+                self._active += 1
+            job.started = time.monotonic()
+            _worker_local.cancel = job.cancel
+            _worker_local.trace = job.trace
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                job.error = e
+            finally:
+                _worker_local.cancel = None
+                _worker_local.trace = None
+            job.finished = time.monotonic()
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+            job.done.set()
+
+
+class _Reservation:
+    """A queue slot admit() set aside for a job that isn't queued yet."""
+
+    def __init__(self, scheduler: _InferenceScheduler):
+        self.scheduler = scheduler
+        self.held = True
+
+    def release(self):
+        self.scheduler.release(self)
+
+
+def _record_job_timing(engine: str, job: _Job):
+    """Accumulate queue wait vs service time on the current request."""
+    _queue_wait_seconds.observe(job.queue_wait_ms / 1000, engine)
+    trace = _current_trace()
+    if trace is not None:
+        trace.stage(f"{engine}_queue", job.queue_wait_ms / 1000)
+    if has_request_context():
+        g.queue_wait_ms = g.get("queue_wait_ms", 0.0) + job.queue_wait_ms
+        g.service_ms = g.get("service_ms", 0.0) + job.service_ms
+    logger.debug(f"{engine}: queued {job.queue_wait_ms:.0f} ms, service {job.service_ms:.0f} ms")
+
+
+def _request_timeout(default_s: float) -> float:
+    """Per-request timeout: the X-Request-Timeout header (seconds), capped
+    at the engine's configured timeout."""
+    supplied = request.headers.get("X-Request-Timeout", type=float)
+    if supplied and supplied > 0:
+        return min(supplied, default_s)
+    return default_s
+
+
+tts_scheduler = _InferenceScheduler(
+    "tts",
+    workers=int(os.environ.get("EMBEDDED_TTS_WORKERS", 1)),
+    max_queue=int(os.environ.get("EMBEDDED_TTS_QUEUE", 8)),
+    timeout_s=float(os.environ.get("EMBEDDED_TTS_TIMEOUT_S", 30)),
+)
+stt_scheduler = _InferenceScheduler(
+    "stt",
+    # One scheduler thread per worker process keeps them all busy.
+    workers=int(os.environ.get("EMBEDDED_STT_WORKERS", max(1, _STT_PROCESSES))),
+    max_queue=int(os.environ.get("EMBEDDED_STT_QUEUE", 4)),
+    timeout_s=float(os.environ.get("EMBEDDED_STT_TIMEOUT_S", 60)),
+)
+
+
+def _overloaded_response(error: _SchedulerError):
+    logger.warning(f"Rejecting request: {error}")
+    response = jsonify({"error": str(error)})
+    response.status_code = error.status
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def _synthesize_pcm(voice: PiperVoice, text: str, length_scale: float) -> bytes:
+    """Synthesize text on an already-loaded Piper voice.
+
+    Runs the ONNX session in-process and accumulates 16-bit mono PCM in
+    memory — no model reload, no subprocess, no temp WAV on disk."""
+    syn_config = SynthesisConfig(length_scale=length_scale)
+    cancel = _job_cancel_token()
+    pcm = io.BytesIO()
+    # Piper yields one chunk per sentence; a cancelled job stops at the
+    # next boundary instead of finishing audio nobody will hear.
+    with _timed("piper"):
+        for chunk in voice.synthesize(text, syn_config):
+            if cancel.cancelled:
+                raise _Cancelled("synthesis cancelled")
+            pcm.write(chunk.audio_int16_bytes)
+    return pcm.getvalue()
+
+
+def _pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """Wrap raw 16-bit mono PCM in a WAV container."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buf.getvalue()
+
+
+# Response formats for /v1/audio/speech (OpenAI's response_format),
+# encoded in memory from the synthesis buffer by libsndfile. WAV is
+# ~32 KB per second of 16 kHz speech; FLAC roughly halves that losslessly
+# and Opus cuts it by ~10x. "pcm" (raw s16le) is handled by the
+# streaming path. Opus only runs at 8/12/16/24/48 kHz, so other voice
+# rates are resampled up to the next one first.
+_AUDIO_FORMATS = {
+    # response_format: (libsndfile format, subtype, mimetype, extension)
+    "wav": ("WAV", "PCM_16", "audio/wav", "wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac", "flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg", "opus"),
+    "ogg": ("OGG", "VORBIS", "audio/ogg", "ogg"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg", "mp3"),
+}
+# Older libsndfile builds lack Opus/MP3; only offer what this one can write.
+_AUDIO_FORMATS = {
+    name: spec for name, spec in _AUDIO_FORMATS.items()
+    if spec[0] in sf.available_formats() and spec[1] in sf.available_subtypes(spec[0])
+}
+_OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def _encode_audio(pcm: bytes, sample_rate: int, response_format: str) -> bytes:
+    """Encode raw 16-bit mono PCM as one of _AUDIO_FORMATS."""
+    if response_format == "wav":
+        return _pcm_to_wav(pcm, sample_rate)
+    audio_format, subtype, _, _ = _AUDIO_FORMATS[response_format]
+    audio = np.frombuffer(pcm, dtype="<i2")
+    if subtype == "OPUS" and sample_rate not in _OPUS_RATES:
+        target = next((rate for rate in _OPUS_RATES if rate >= sample_rate), _OPUS_RATES[-1])
+        audio = _resample(audio.astype(np.float32) / 32768.0, sample_rate, target)
+        sample_rate = target
+    buf = io.BytesIO()
+    sf.write(buf, audio, sample_rate, format=audio_format, subtype=subtype)
+    return buf.getvalue()
+
+
+# TTS audio cache. Scenario openers, canned prompts and short
+# acknowledgements are synthesized over and over across sessions; a hit
+# here skips Piper entirely. Keys are content-addressed (see key()), so
+# swapping a model file or changing speed can never serve stale audio.
+# The memory tier is always on (EMBEDDED_TTS_CACHE_MB=0 disables it);
+# the disk tier only when EMBEDDED_TTS_CACHE_DIR is set.
+class _TTSCache:
+    """Size-bounded LRU cache of synthesized PCM: memory tier + optional disk tier."""
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str] = None, disk_bytes: int = 0):
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[bytes, int]]" = OrderedDict()
+        self._memory_bytes = memory_bytes
+        self._memory_used = 0
+        self._disk_dir = disk_dir if disk_dir and disk_bytes > 0 else None
+        self._disk_bytes = disk_bytes
+        self._disk_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self._disk_dir:
+            os.makedirs(self._disk_dir, exist_ok=True)
+            self._disk_used = sum(e.stat().st_size for e in self._disk_entries())
+
+    @property
+    def enabled(self) -> bool:
+        return self._memory_bytes > 0 or self._disk_dir is not None
+
+    @staticmethod
+    def key(text: str, voice_name: str, length_scale: float, model_sha256: str) -> str:
+        normalized = " ".join(text.split())
+        material = json.dumps([normalized, voice_name, round(length_scale, 3), model_sha256])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, int]]:
+        """Return (pcm, sample_rate) or None. Disk hits are promoted to memory."""
+        with _timed("cache_lookup"):
+            entry = self._get(key)
+        trace = _current_trace()
+        if trace is not None:
+            trace.count("cache_hits" if entry is not None else "cache_misses")
+        return entry
+
+    def _get(self, key: str) -> Optional[Tuple[bytes, int]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._memory_put(key, entry)
+        return entry
+
+    def put(self, key: str, pcm: bytes, sample_rate: int):
+        with self._lock:
+            self._memory_put(key, (pcm, sample_rate))
+        self._disk_put(key, pcm, sample_rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_budget_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_used,
+                "disk_budget_bytes": self._disk_bytes if self._disk_dir else 0,
+            }
+
+    # Callers hold self._lock.
+    def _memory_put(self, key: str, entry: Tuple[bytes, int]):
+        size = len(entry[0])
+        if size > self._memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous[0])
+        self._memory[key] = entry
+        self._memory_used += size
+        while self._memory_used > self._memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            self.evictions += 1
+
+    def _disk_entries(self):
+        return [e for e in os.scandir(self._disk_dir) if e.name.endswith(".wav")]
+
+    def _disk_get(self, key: str) -> Optional[Tuple[bytes, int]]:
+        if not self._disk_dir:
+            return None
+        path = os.path.join(self._disk_dir, f"{key}.wav")
+        try:
+            with wave.open(path, "rb") as wav_file:
+                entry = (wav_file.readframes(wav_file.getnframes()), wav_file.getframerate())
+            os.utime(path)  # mtime is the disk tier's LRU clock
+            return entry
+        except (OSError, EOFError, wave.Error):
+            return None
+
+    def _disk_put(self, key: str, pcm: bytes, sample_rate: int):
+        if not self._disk_dir:
+            return
+        data = _pcm_to_wav(pcm, sample_rate)
+        if len(data) > self._disk_bytes:
+            return
+        path = os.path.join(self._disk_dir, f"{key}.wav")
+        try:
+            if os.path.exists(path):
+                return
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_used += len(data)
+                if self._disk_used <= self._disk_bytes:
+                    return
+                entries = sorted(self._disk_entries(), key=lambda e: e.stat().st_mtime)
+                for entry in entries:
+                    if self._disk_used <= self._disk_bytes:
+                        break
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self._disk_used -= size
+                    self.evictions += 1
+        except OSError as e:
+            logger.warning(f"TTS disk cache write failed: {e}")
+
+
+tts_cache = _TTSCache(
+    memory_bytes=int(float(os.environ.get("EMBEDDED_TTS_CACHE_MB", 32)) * 1024 * 1024),
+    disk_dir=os.environ.get("EMBEDDED_TTS_CACHE_DIR") or None,
+    disk_bytes=int(float(os.environ.get("EMBEDDED_TTS_CACHE_DISK_MB", 256)) * 1024 * 1024),
+)
+
+
+def _cached_synthesize_pcm(voice: PiperVoice, info: _VoiceInfo, text: str, length_scale: float,
+                           timeout: Optional[float] = None, cancel: Optional[_CancelToken] = None,
+                           reservation: Optional[_Reservation] = None, lookup: bool = True) -> bytes:
+    """_synthesize_pcm() behind the TTS cache. Hits skip the scheduler queue.
+
+    lookup=False: the caller has already missed in the cache for this text."""
+    key = tts_cache.key(text, info.key, length_scale, info.sha256)
+    cached = tts_cache.get(key) if lookup else None
+    if cached is not None:
+        return cached[0]
+    pcm = tts_scheduler.run(_synthesize_pcm, voice, text, length_scale, timeout=timeout, cancel=cancel,
+                            reservation=reservation)
+    tts_cache.put(key, pcm, voice.config.sample_rate)
+    return pcm
+
+
+def _synthesize_sentence(voice: PiperVoice, info: _VoiceInfo, sentence: str, length_scale: float,
+                         timeout: Optional[float], cancel: _CancelToken) -> bytes:
+    """_cached_synthesize_pcm() for a sentence partway through a reply.
+
+    The client can't retry one sentence of audio that is already playing,
+    so a full queue is waited out (up to the timeout) instead of failing."""
+    deadline = time.monotonic() + (timeout if timeout is not None else tts_scheduler.timeout_s)
+    while True:
+        try:
+            return _cached_synthesize_pcm(voice, info, sentence, length_scale,
+                                          max(0.0, deadline - time.monotonic()), cancel=cancel)
+        except _QueueFull:
+            if time.monotonic() > deadline or cancel.cancelled:
+                raise
+            time.sleep(0.05)
+
+
+# Sentence splitting — a port of the renderer's SentenceStream
+# (src/renderer/services/sentenceStream.ts) so server-side chunking
+# breaks text at the same boundaries the client pipeline does.
+_ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr",
+    "st", "mt", "ave", "blvd",
+    "e.g", "i.e", "etc", "vs", "cf",
+}
+_TERMINATORS = ".!?…"
+_MAX_SENTENCE_BUFFER = 200
+
+
+class _SentenceStream:
+    """Stateful sentence accumulator: feed() text, get finished sentences."""
+
+    def __init__(self):
+        self._buf = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buf += text
+        out = []
+
+        i = 0
+        while i < len(self._buf):
+            if self._buf[i] in _TERMINATORS:
+                is_boundary = i + 1 < len(self._buf) and self._buf[i + 1].isspace()
+                if is_boundary and not self._ends_with_abbreviation(i):
+                    sentence = self._buf[:i + 1].strip()
+                    if sentence:
+                        out.append(sentence)
+                    self._buf = self._buf[i + 1:].lstrip()
+                    i = 0
+                    continue
+            i += 1
+
+        if len(self._buf) >= _MAX_SENTENCE_BUFFER:
+            sentence = self._buf.strip()
+            if sentence:
+                out.append(sentence)
+            self._buf = ""
+
+        return out
+
+    def flush(self) -> List[str]:
+        remaining = self._buf.strip()
+        self._buf = ""
+        return [remaining] if remaining else []
+
+    def _ends_with_abbreviation(self, terminator_idx: int) -> bool:
+        start = terminator_idx - 1
+        while start >= 0 and (self._buf[start].isascii() and self._buf[start].isalpha() or self._buf[start] == "."):
+            start -= 1
+        return self._buf[start + 1:terminator_idx].lower() in _ABBREVIATIONS
+
+
+def _split_sentences(text: str) -> List[str]:
+    stream = _SentenceStream()
+    return stream.feed(text) + stream.flush()
+
+
+def _streaming_wav_header(sample_rate: int) -> bytes:
+    """WAV header for 16-bit mono PCM of unknown length.
+
+    The RIFF and data chunk sizes are 0xFFFFFFFF, the usual convention
+    for "read until EOF", so the header can go out before the first
+    sentence is synthesized and never has to be patched."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", 0xFFFFFFFF,
+    )
+
+
+def _voice_options(data: dict) -> Tuple[str, Optional[int], float]:
+    """(voice, voice_id, length_scale) from a speech request; ValueError if malformed."""
+    voice = data.get('voice', 'female')
+    if not isinstance(voice, str):
+        raise ValueError("'voice' must be a string")
+    speed = data.get('speed', 1.2)  # Speech speed multiplier (default 1.2x)
+    if isinstance(speed, bool) or not isinstance(speed, (int, float)):
+        raise ValueError("'speed' must be a number")
+    # Convert speed to Piper length_scale (inverse relationship)
+    length_scale = 1.0 / speed if speed > 0 else 0.83  # Default to 1.2x speed
+    return voice, data.get('voice_id'), length_scale
+
+
+def _text_input(data: dict) -> str:
+    """The 'input' text of a speech request ('' if absent); ValueError if not a string."""
+    text = data.get('input', '')
+    if not isinstance(text, str):
+        raise ValueError("'input' must be a string")
+    return text
+
+
+def _select_voice(voice: str = "female", voice_id: int = None):
+    """Pick a Piper voice from the registry, loading it first if needed.
+
+    Returns (voice, info); voice is None if nothing matches or it
+    failed to load."""
+    # Before discovery the registry is empty, not missing the voice:
+    # wait as for a loading component.
+    started = time.monotonic()
+    voice_registry.discovered.wait(_LOAD_WAIT_S)
+    info = voice_registry.resolve(voice, voice_id)
+    if info is None:
+        return None, None
+    return voice_registry.load(info, max(0.0, _LOAD_WAIT_S - (time.monotonic() - started))), info
+
+
+def text_to_speech(text: str, voice: str = "female", voice_id: int = None, length_scale: float = 0.83,
+                   timeout: Optional[float] = None) -> Optional[Tuple[bytes, int]]:
+    """Convert text to speech using Piper TTS; returns (16-bit PCM, sample rate)"""
+    try:
+        piper_voice, info = _select_voice(voice, voice_id)
+        if piper_voice is None:
+            logger.error(f"Piper voice not available: {info.display_name if info else voice}")
+            return None
+        logger.debug(f"Using voice: {info.display_name} (length_scale={length_scale:.2f})")
+        _annotate(voice=info.key, chars=len(text), length_scale=round(length_scale, 3))
+
+        # Synthesize on the voice loaded at startup. This used to shell
+        # out to `venv/bin/piper`, which reloaded the ONNX model from disk
+        # and round-tripped a temp WAV on every request (and silently
+        # dropped length_scale, so the speed setting did nothing).
+        started = time.perf_counter()
+        pcm = _cached_synthesize_pcm(piper_voice, info, text, length_scale, timeout)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.debug(f"Synthesized {len(text)} chars in {elapsed_ms:.0f} ms")
+
+        return pcm, piper_voice.config.sample_rate
+
+    except _SchedulerError:
+        raise
+    except Exception as e:
+        logger.error(f"Piper TTS conversion failed: {e}")
+        return None
+
+
+def text_to_speech_stream(text: str, voice: str = "female", voice_id: int = None,
+                          length_scale: float = 0.83, container: str = "wav",
+                          timeout: Optional[float] = None) -> Optional[Tuple[int, Iterator[bytes]]]:
+    """Sentence-chunked Piper synthesis for streaming responses.
+
+    Returns None if the voices aren't loaded; otherwise (sample_rate,
+    generator). The generator yields a stable header (WAV only) and then
+    one PCM chunk per sentence, so the first sentence can play while the
+    rest synthesize."""
+    piper_voice, info = _select_voice(voice, voice_id)
+    if piper_voice is None:
+        logger.error(f"Piper voice not available: {info.display_name if info else voice}")
+        return None
+
+    # Reserve the first sentence's queue slot while we can still send a
+    # 429 — once the first chunk is out the status line is committed.
+    reservation = tts_scheduler.admit()
+
+    sentences = _split_sentences(text)
+    logger.debug(f"Streaming {len(sentences)} sentence(s) with voice: {info.display_name} (length_scale={length_scale:.2f})")
+    _annotate(voice=info.key, chars=len(text), sentences=len(sentences), length_scale=round(length_scale, 3))
+
+    cancel = _request_cancel_token() or _CancelToken()
+
+    def generate():
+        completed = False
+        try:
+            yield from stream(cancel)
+            completed = True
+        finally:
+            reservation.release()  # unused if the first sentence was cached
+            # Closed before the last sentence: the client disconnected
+            # (barge-in). Stop any queued or running synthesis for it.
+            if not completed:
+                cancel.cancel()
+
+    def stream(cancel: _CancelToken):
+        if container == "wav":
+            yield _streaming_wav_header(piper_voice.config.sample_rate)
+        started = time.perf_counter()
+        for i, sentence in enumerate(sentences):
+            try:
+                if cancel.cancelled:
+                    raise _Cancelled("stream cancelled")
+                if i == 0:
+                    pcm = _cached_synthesize_pcm(piper_voice, info, sentence, length_scale, timeout,
+                                                 cancel=cancel, reservation=reservation)
+                else:
+                    pcm = _synthesize_sentence(piper_voice, info, sentence, length_scale, timeout, cancel)
+            except _Cancelled:
+                logger.info(f"Stream cancelled after {i}/{len(sentences)} sentence(s)")
+                return
+            except Exception as e:
+                # Headers are already sent — all we can do is end the stream
+                # and record why on the trace.
+                if isinstance(e, _SchedulerError):
+                    logger.warning(f"TTS stream ended at sentence {i + 1}/{len(sentences)}: {e}")
+                else:
+                    logger.error(f"Piper TTS failed on sentence {i + 1}/{len(sentences)}: {e}")
+                _annotate(error=str(e), sentences_done=i)
+                return
+            if i == 0:
+                first_ms = (time.perf_counter() - started) * 1000
+                logger.debug(f"First sentence ready in {first_ms:.0f} ms")
+                _annotate(first_sentence_ms=round(first_ms, 1))
+            yield pcm
+
+    return piper_voice.config.sample_rate, generate()
+
+
+# Batch pre-rendering. A scenario's fixed lines (openings, prompts) can be
+# synthesized in one call when the scenario is opened; each rendered
+# item lands in the TTS cache, so the live /v1/audio/speech request for
+# the same line is a cache hit, and the manifest's IDs can be fetched
+# directly from /v1/audio/speech/cache/<id>. Items fan out across the
+# TTS workers, but a batch never has more than one job per worker in the
+# scheduler queue, so live requests only wait behind one item each.
+_BATCH_MAX_ITEMS = int(os.environ.get("EMBEDDED_TTS_BATCH_MAX", 64))
+_batch_executor = ThreadPoolExecutor(max_workers=tts_scheduler.workers, thread_name_prefix="tts-batch")
+
+
+def _render_batch_item(index: int, item: dict, timeout: Optional[float], cancel: _CancelToken) -> dict:
+    """Synthesize one batch item into the TTS cache and describe the result."""
+    if cancel.cancelled:
+        return {"index": index, "error": "cancelled"}
+    if not isinstance(item, dict):
+        return {"index": index, "error": "Item must be an object"}
+    text = item.get('input') or item.get('text') or ''
+    if not text:
+        return {"index": index, "error": "No input text provided"}
+    if not isinstance(text, str):
+        return {"index": index, "error": "'input' must be a string"}
+    try:
+        voice, voice_id, length_scale = _voice_options(item)
+    except ValueError as e:
+        return {"index": index, "error": str(e)}
+
+    piper_voice, info = _select_voice(voice, voice_id)
+    if piper_voice is None:
+        return {"index": index, "error": "Voice not available"}
+
+    key = tts_cache.key(text, info.key, length_scale, info.sha256)
+    cached = tts_cache.get(key)
+    if cached is not None:
+        pcm, sample_rate = cached
+    else:
+        try:
+            pcm = _cached_synthesize_pcm(piper_voice, info, text, length_scale, timeout,
+                                         cancel=cancel, lookup=False)
+        except _SchedulerError as e:
+            return {"index": index, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {e}")
+            return {"index": index, "error": "Failed to generate speech"}
+        sample_rate = piper_voice.config.sample_rate
+    return {
+        "index": index,
+        "id": key,
+        "voice": info.key,
+        "duration": round(len(pcm) / 2 / sample_rate, 3),
+        "cached": cached is not None,
+    }
+
+
+def _with_trace(trace: Optional[_RequestTrace], fn, *args):
+    """Run fn(*args) on a pool thread with the submitting request's trace."""
+    _worker_local.trace = trace
+    try:
+        return fn(*args)
+    finally:
+        _worker_local.trace = None
+
+
+def text_to_speech_batch(items: List[dict], timeout: Optional[float], cancel: _CancelToken) -> Iterator[dict]:
+    """Render items in parallel; yield each item's result as it finishes."""
+    trace = _current_trace()
+    futures = [_batch_executor.submit(_with_trace, trace, _render_batch_item, i, item, timeout, cancel)
+               for i, item in enumerate(items)]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Abandoned early (client went away): skip whatever hasn't started.
+        for future in futures:
+            future.cancel()
+
+
+# Incremental TTS. /v1/audio/speech needs the whole reply up front, so
+# nothing is heard until the LLM has finished generating. A speech
+# session takes the reply while it is being written: the client appends
+# text deltas, each sentence the splitter completes is synthesized on the
+# session's thread while more text arrives, and GET .../audio streams the
+# sentences' audio in order. Sentence N is synthesized while the LLM
+# writes sentence N+1.
+_TTS_SESSION_IDLE_S = float(os.environ.get("EMBEDDED_TTS_SESSION_IDLE_S", 60))
+_TTS_SESSION_MAX = int(os.environ.get("EMBEDDED_TTS_SESSION_MAX", 4))
+
+
+class _SpeechSession:
+    """One reply being spoken while it is still being written."""
+
+    def __init__(self, piper_voice: PiperVoice, info: _VoiceInfo, length_scale: float, container: str):
+        self.id = uuid.uuid4().hex
+        self.voice = piper_voice
+        self.info = info
+        self.length_scale = length_scale
+        self.container = container
+        self.sample_rate = piper_voice.config.sample_rate
+        self.cancel = _CancelToken()
+        self.last_active = time.monotonic()
+        self.trace: Optional[_RequestTrace] = None  # the audio request's, once attached
+        self.reader_attached = False
+        self._lock = threading.Lock()
+        self._splitter = _SentenceStream()
+        self._sentences: "queue.Queue[Optional[str]]" = queue.Queue()  # None: no more text
+        self._audio: "queue.Queue[Optional[bytes]]" = queue.Queue()  # None: end of audio
+        self._received_chars = 0
+        self._queued = 0
+        self._synthesized = 0
+        self._finished = False
+        self._error: Optional[str] = None
+        self.cancel.on_cancel(lambda: self._sentences.put(None))
+        threading.Thread(target=self._synthesize_loop, name=f"tts-session-{self.id[:8]}", daemon=True).start()
+
+    def append(self, text: str) -> bool:
+        """Add a text delta; False if the session was already finished."""
+        with self._lock:
+            if self._finished:
+                return False
+            self.last_active = time.monotonic()
+            self._received_chars += len(text)
+            # Queued under the lock so concurrent appends keep their order.
+            self._queue(self._splitter.feed(text))
+        return True
+
+    def finish(self, text: str = ""):
+        """No more text: the buffered remainder becomes the last sentence."""
+        with self._lock:
+            if self._finished:
+                return
+            self.last_active = time.monotonic()
+            self._received_chars += len(text)
+            self._queue(self._splitter.feed(text) + self._splitter.flush())
+            self._finished = True
+            self._sentences.put(None)
+
+    def _queue(self, sentences: List[str]):
+        self._queued += len(sentences)
+        for sentence in sentences:
+            self._sentences.put(sentence)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "object": "speech.session",
+                "voice": self.info.key,
+                "sample_rate": self.sample_rate,
+                "response_format": self.container,
+                "received_chars": self._received_chars,
+                "sentences": self._queued,
+                "synthesized": self._synthesized,
+                "finished": self._finished,
+                "error": self._error,
+            }
+
+    def audio(self) -> Iterator[bytes]:
+        """The WAV header (if any), then each sentence's PCM as it is ready."""
+        if self.container == "wav":
+            yield _streaming_wav_header(self.sample_rate)
+        while True:
+            try:
+                pcm = self._audio.get(timeout=1.0)
+            except queue.Empty:
+                # Nothing is written while waiting for text, so a client
+                # that has gone away only shows up as the session idling.
+                if self.cancel.cancelled or time.monotonic() - self.last_active > _TTS_SESSION_IDLE_S:
+                    self.cancel.cancel()
+                    return
+                continue
+            if pcm is None:
+                return
+            self.last_active = time.monotonic()
+            yield pcm
+
+    def _synthesize_loop(self):
+        while True:
+            sentence = self._sentences.get()
+            if sentence is None or self.cancel.cancelled:
+                break
+            try:
+                pcm = _with_trace(self.trace, _synthesize_sentence, self.voice, self.info, sentence,
+                                  self.length_scale, None, self.cancel)
+            except _Cancelled:
+                break
+            except Exception as e:
+                # The audio stream's headers may be out already — all we
+                # can do is end it and report the error in state().
+                logger.error(f"Speech session {self.id[:8]}: synthesis failed: {e}")
+                with self._lock:
+                    self._error = str(e)
+                break
+            with self._lock:
+                self._synthesized += 1
+            self._audio.put(pcm)
+        self._audio.put(None)
+
+
+
+_speech_sessions_lock = threading.Lock()
+_speech_sessions: Dict[str, _SpeechSession] = {}
+
+
+def _reap_idle_speech_sessions():
+    now = time.monotonic()
+    with _speech_sessions_lock:
+        idle = [sid for sid, s in _speech_sessions.items() if now - s.last_active > _TTS_SESSION_IDLE_S]
+        for sid in idle:
+            _speech_sessions.pop(sid).cancel.cancel()
+    for sid in idle:
+        logger.info(f"Dropped idle speech session {sid[:8]}")
+
+
+def _reap_speech_sessions_forever():
+    # Create-time reaping alone leaves an abandoned session (and a reader
+    # blocked on it) alive until somebody opens another one.
+    while True:
+        time.sleep(min(5.0, max(0.5, _TTS_SESSION_IDLE_S / 2)))
+        _reap_idle_speech_sessions()
+
+
+threading.Thread(target=_reap_speech_sessions_forever, name="tts-session-reaper", daemon=True).start()
 
-# Localhost-only is not enough: any local process (and, via form POSTs,
-# potentially any webpage in the user's browser) can reach 127.0.0.1.
-# Electron main generates a per-session token and passes it via env;
-# every route except /health requires it. When the env var is absent
-# (running the server standalone in dev) auth is disabled.
-_AUTH_TOKEN = os.environ.get("EMBEDDED_AUTH_TOKEN", "")
 
+def _get_speech_session(session_id: str) -> Optional[_SpeechSession]:
+    with _speech_sessions_lock:
+        return _speech_sessions.get(session_id)
 
-@app.before_request
-def _require_auth():
-    if not _AUTH_TOKEN or request.path == "/health":
-        return None
-    supplied = request.headers.get("Authorization", "")
-    if supplied.startswith("Bearer "):
-        supplied = supplied[len("Bearer "):]
-    if not hmac.compare_digest(supplied, _AUTH_TOKEN):
-        return jsonify({"error": "Unauthorized"}), 401
-    return None
 
-# Global variables
-piper_male_voice = None
-piper_female_voice = None
-whisper_model = None
+# Whisper consumes 16 kHz mono float32. Uploads are decoded straight to
+# that in memory: containers libsndfile understands (WAV, FLAC, OGG) are
+# read from a BytesIO and resampled with NumPy; anything else (the
+# renderer's WebM/Opus) is piped through ffmpeg over stdin/stdout. No
+# temp files, and no disk re-read by pywhispercpp.
+_WHISPER_SAMPLE_RATE = 16000
+_RAW_PCM_TYPES = {"audio/pcm", "audio/l16", "audio/x-raw"}
 
-# HuggingFace base URL for Piper voice downloads. Matches what
-# setup.sh and .github/workflows/build.yml use — single source of
-# truth would live in a shared config file, but duplication across
-# three callers is acceptable for a stable upstream path.
-_PIPER_BASE = "https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en"
-# url + pinned SHA-256 per file. HTTPS protects the transport; the pin
-# protects against a compromised upstream serving a poisoned model.
-# Hashes computed from the v1.0.0 tag (immutable revision).
-_PIPER_MODELS = {
-    "en_GB-alan-low.onnx": (
-        f"{_PIPER_BASE}/en_GB/alan/low/en_GB-alan-low.onnx",
-        "a1f60584620a2bed203de823d08f5abb336fb15f3d6f33f8c341e3e2cabf5dde",
-    ),
-    "en_GB-alan-low.onnx.json": (
-        f"{_PIPER_BASE}/en_GB/alan/low/en_GB-alan-low.onnx.json",
-        "c8164cc04b6ce102c651ce4a1e788e8429fa638501fca0723860718d4b44637e",
-    ),
-    "en_US-amy-low.onnx": (
-        f"{_PIPER_BASE}/en_US/amy/low/en_US-amy-low.onnx",
-        "a5a91abb7de0f104358a25aded480ddacf1ff0762886325886ec406a2e86aab3",
-    ),
-    "en_US-amy-low.onnx.json": (
-        f"{_PIPER_BASE}/en_US/amy/low/en_US-amy-low.onnx.json",
-        "2250a9a605b8dc35a116717fadc5056695dd809e34a15d02f72a0f52d53d3ebb",
-    ),
-}
 
+# Raw PCM carries no header, so its rate comes from the client. Outside
+# this range it is a mistake, and a tiny rate would resample a short
+# upload into gigabytes.
+_PCM_RATE_RANGE = (8000, 192000)
 
-def _sha256_of(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
 
+def _pcm_sample_rate(value) -> int:
+    """A client-supplied PCM sample rate; ValueError unless an integer in _PCM_RATE_RANGE."""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    low, high = _PCM_RATE_RANGE
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise ValueError(f"'sample_rate' must be an integer from {low} to {high}")
+    return value
 
-def _download_piper_models_if_missing():
-    """Self-heal: if the models directory is missing any Piper files,
-    download them from HuggingFace before PiperVoice.load() runs.
 
-    This is a runtime safety net for dev environments where setup.sh
-    was skipped or ran before the download step existed. In a packaged
-    release the models are bundled via PyInstaller --add-data so this
-    block is a no-op."""
-    # Don't try to download in a PyInstaller bundle — models ship inside.
-    if hasattr(sys, "_MEIPASS"):
-        return
+# Half-width of the resampler's anti-alias filter, in zero crossings of
+# its sinc. 16 puts the stop band (over 80 dB down) just past the new Nyquist.
+_RESAMPLE_ZERO_CROSSINGS = 16
+
+
+@functools.lru_cache(maxsize=16)
+def _lowpass_kernel(src_rate: int, dst_rate: int) -> np.ndarray:
+    """Blackman-windowed sinc at src_rate passing ~90% of dst_rate's Nyquist."""
+    cutoff = 0.45 * dst_rate / src_rate  # cycles per input sample
+    half = int(np.ceil(_RESAMPLE_ZERO_CROSSINGS / (2 * cutoff)))
+    n = np.arange(-half, half + 1)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(len(n))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def _resample(audio: np.ndarray, src_rate: int, dst_rate: int = _WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """Resample mono float32 audio to dst_rate."""
+    if src_rate == dst_rate or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+    if src_rate > dst_rate:
+        # Low-pass below the new Nyquist first: whatever lies between it
+        # and the old one (8-22 kHz from a 44.1k WAV) would otherwise fold
+        # back into Whisper's band. Edge padding keeps a streamed chunk's
+        # ends from being pulled towards silence.
+        kernel = _lowpass_kernel(src_rate, dst_rate)
+        padded = np.pad(audio.astype(np.float32, copy=False), len(kernel) // 2, mode="edge")
+        audio = np.convolve(padded, kernel, mode="valid")
+    if src_rate % dst_rate == 0:
+        # Integer ratio (48k/32k → 16k, the common mic rates): plain decimation.
+        return audio[::src_rate // dst_rate].astype(np.float32, copy=False)
+    n_out = int(round(len(audio) * dst_rate / src_rate))
+    positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def _ffmpeg_decode(audio_data: bytes) -> np.ndarray:
+    """Decode any ffmpeg-readable container to 16 kHz mono float32 over pipes."""
+    with _timed("ffmpeg"):
+        process = subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-ar', str(_WHISPER_SAMPLE_RATE),  # 16kHz sample rate
+            '-ac', '1',                        # Mono
+            '-f', 'f32le',
+            'pipe:1',
+        ], input=audio_data, capture_output=True, check=True)
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
 
-    os.makedirs("models", exist_ok=True)
-    for filename, (url, expected_sha256) in _PIPER_MODELS.items():
-        dest = os.path.join("models", filename)
-        if os.path.exists(dest) and os.path.getsize(dest) > 0:
-            continue
-        logger.info(f"Piper model missing, downloading: {filename}")
+def _decode_audio(audio_data: bytes, content_type: str = "", sample_rate: int = _WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """Decode an upload to the 16 kHz mono float32 array Whisper expects.
+
+    Raw PCM (content type audio/pcm or audio/L16) is taken as s16le at
+    `sample_rate`."""
+    if content_type.split(";")[0].strip().lower() in _RAW_PCM_TYPES:
+        audio = np.frombuffer(audio_data[:len(audio_data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+        return _resample(audio, sample_rate)
+
+    # WebM/Matroska (EBML magic) is what MediaRecorder produces; libsndfile
+    # can't read it, so don't bother trying.
+    if not audio_data.startswith(b"\x1a\x45\xdf\xa3"):
         try:
-            urllib.request.urlretrieve(url, dest)
-            actual = _sha256_of(dest)
-            if actual != expected_sha256:
-                raise ValueError(
-                    f"checksum mismatch (expected {expected_sha256}, got {actual})"
-                )
-            logger.info(f"  → saved {dest} ({os.path.getsize(dest)} bytes, sha256 ok)")
-        except Exception as e:
-            logger.error(f"  ✗ download failed for {url}: {e}")
-            # Leave any partial/poisoned file removed so the next attempt
-            # retries cleanly.
-            try:
-                if os.path.exists(dest):
-                    os.remove(dest)
-            except OSError:
-                pass
+            audio, src_rate = sf.read(io.BytesIO(audio_data), dtype="float32", always_2d=True)
+            return _resample(audio.mean(axis=1), src_rate)
+        except (RuntimeError, sf.LibsndfileError):
+            pass  # not a libsndfile format — fall through to ffmpeg
 
+    return _ffmpeg_decode(audio_data)
 
-def initialize_tts():
-    """Initialize Piper TTS with Alan (male) and Amy (female) voices"""
-    global piper_male_voice, piper_female_voice
 
-    # Runtime self-heal — download any missing model files before load.
-    _download_piper_models_if_missing()
+# Voice-activity detection. Recorded Turns carry leading/trailing
+# silence and pauses, and Whisper's cost grows with audio length. A
+# framewise energy detector (vectorised NumPy, no model) finds the
+# speech, the clip is trimmed to it, silent uploads never reach Whisper,
+# and — if EMBEDDED_VAD_SPLIT_PAUSE_MS is set — pauses at least that
+# long split the clip into separately transcribed pieces.
+_VAD_ENABLED = os.environ.get("EMBEDDED_VAD", "1") != "0"
+_VAD_FRAME_MS = 30
+_VAD_PAD_MS = int(os.environ.get("EMBEDDED_VAD_PAD_MS", 200))
+_VAD_FLOOR_DB = float(os.environ.get("EMBEDDED_VAD_FLOOR_DB", -50))
+_VAD_SPLIT_PAUSE_MS = int(os.environ.get("EMBEDDED_VAD_SPLIT_PAUSE_MS", 0))
 
-    try:
-        # Load male voice (Alan - British)
-        male_model_path = "models/en_GB-alan-low.onnx"
-        if os.path.exists(male_model_path):
-            piper_male_voice = PiperVoice.load(male_model_path)
-            logger.info("Loaded Alan (male) voice successfully")
-        else:
-            logger.error(f"Male voice model not found: {male_model_path}")
-            return False
-
-        # Load female voice (Amy - American)
-        female_model_path = "models/en_US-amy-low.onnx"
-        if os.path.exists(female_model_path):
-            piper_female_voice = PiperVoice.load(female_model_path)
-            logger.info("Loaded Amy (female) voice successfully")
+
+def _detect_speech(audio: np.ndarray, sample_rate: int = _WHISPER_SAMPLE_RATE) -> List[Tuple[int, int]]:
+    """Return (start, end) sample ranges containing speech, padded by
+    _VAD_PAD_MS. An empty list means the clip is silent."""
+    frame = sample_rate * _VAD_FRAME_MS // 1000
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    # Adaptive threshold: 10 dB over the quietest frames (the room's
+    # noise floor), never below an absolute floor, and never so close to
+    # the peak that a clip that is speech end to end gets carved up.
+    noise_db = np.percentile(energy_db, 10)
+    peak_db = energy_db.max()
+    threshold = max(_VAD_FLOOR_DB, min(noise_db + 10, peak_db - 20))
+    voiced = energy_db > threshold
+    if not voiced.any():
+        return []
+
+    # Pad speech by _VAD_PAD_MS so word onsets/tails aren't clipped.
+    pad = max(1, _VAD_PAD_MS // _VAD_FRAME_MS)
+    voiced = np.convolve(voiced, np.ones(2 * pad + 1), mode="same") > 0
+
+    # Run boundaries: +1 where speech starts, -1 where it ends.
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    ranges: List[Tuple[int, int]] = []
+    split_gap = _VAD_SPLIT_PAUSE_MS // _VAD_FRAME_MS if _VAD_SPLIT_PAUSE_MS > 0 else None
+    for start, end in zip(starts, ends):
+        if ranges and (split_gap is None or start - ranges[-1][1] < split_gap):
+            ranges[-1] = (ranges[-1][0], end)
         else:
-            logger.error(f"Female voice model not found: {female_model_path}")
-            return False
+            ranges.append((start, end))
+    return [(int(start) * frame, min(len(audio), int(end) * frame)) for start, end in ranges]
 
-        logger.info("Piper TTS initialized with Alan (male) and Amy (female) voices")
-        return True
 
-    except Exception as e:
-        logger.error(f"Failed to initialize Piper TTS: {e}")
-        return False
+def _transcribe(audio: np.ndarray, model_name: str):
+    cancel = _job_cancel_token()
+    # Acquire here rather than trusting the caller's check: the model may
+    # have been unloaded to make room while this job sat in the queue.
+    model = whisper_pool.acquire(model_name, _LOAD_WAIT_S)
+    if model is None:
+        raise RuntimeError(f"Whisper {model_name} model not available")
+    with whisper_pool.lock(model_name), _timed("whisper"):
+        segments = model.transcribe(audio, abort_callback=lambda: cancel.cancelled)
+    if cancel.cancelled:
+        raise _Cancelled("transcription cancelled")
+    return segments
 
-def categorize_voices():
-    """Return fixed Piper voice categories with Alan (male) and Amy (female)"""
-    global piper_male_voice, piper_female_voice
-    
-    male_voices = []
-    female_voices = []
-    
-    if piper_male_voice:
-        male_voices.append({
-            "id": 0,
-            "name": "Alan (British Male)",
-            "gender": "male",
-            "language": "en_GB"
-        })
-    
-    if piper_female_voice:
-        female_voices.append({
-            "id": 1,
-            "name": "Amy (American Female)",
-            "gender": "female", 
-            "language": "en_US"
-        })
-    
-    return {
-        "male": male_voices,
-        "female": female_voices,
-        "unknown": [],
-        "all": male_voices + female_voices
-    }
 
-def initialize_whisper():
-    """Initialize the Whisper model for STT"""
-    global whisper_model
+def speech_to_text(audio_data: bytes, content_type: str = "", sample_rate: int = _WHISPER_SAMPLE_RATE,
+                   timeout: Optional[float] = None, model_name: Optional[str] = None) -> Optional[dict]:
+    """Convert speech to text using Whisper"""
+    model_name = model_name or whisper_pool.default
+    if not whisper_pool.component(model_name).ensure(_LOAD_WAIT_S):
+        logger.error(f"Whisper {model_name} model not initialized")
+        return None
     
     try:
-        logger.info("Loading Whisper model (this may take a moment)...")
-        
-        # Check if running from PyInstaller bundle
-        if hasattr(sys, '_MEIPASS'):
-            # Running from PyInstaller bundle, use bundled model
-            model_path = os.path.join(sys._MEIPASS, 'whisper-models', 'ggml-tiny.bin')
-            if os.path.exists(model_path):
-                logger.info(f"Using bundled whisper model: {model_path}")
-                # pywhispercpp will use the bundled model
-                os.environ['PYWHISPER_MODEL_DIR'] = os.path.join(sys._MEIPASS, 'whisper-models')
-        
-        # Using pywhispercpp which is much lighter than openai-whisper
-        whisper_model = WhisperModel("tiny")  # Start with tiny model for speed
-        logger.info("Whisper model loaded successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to initialize Whisper model: {e}")
-        return False
+        logger.debug(f"Processing audio data: {len(audio_data)} bytes")
 
-def text_to_speech(text: str, voice_type: str = "female", voice_id: int = None, length_scale: float = 0.83) -> Optional[bytes]:
-    """Convert text to speech using Piper TTS"""
-    global piper_male_voice, piper_female_voice
-    
-    if not piper_male_voice or not piper_female_voice:
-        logger.error("Piper voices not initialized")
+        started = time.perf_counter()
+        with _timed("decode"):
+            audio = _decode_audio(audio_data, content_type, sample_rate)
+        decoded = time.perf_counter()
+        logger.debug(f"Decoded {len(audio) / _WHISPER_SAMPLE_RATE:.2f}s of audio in {(decoded - started) * 1000:.0f} ms")
+
+        # Duration of the decoded audio in seconds (segment t1 values are
+        # in 10 ms units, so they can't be reported directly).
+        duration = len(audio) / _WHISPER_SAMPLE_RATE
+        _annotate(model=model_name, audio_s=round(duration, 2))
+
+        pieces = [audio]
+        if _VAD_ENABLED:
+            speech = _detect_speech(audio)
+            if not speech:
+                logger.debug("No speech detected — skipping Whisper")
+                _annotate(speech=False)
+                return {"text": "", "duration": duration, "trimmed_ms": round(duration * 1000)}
+            pieces = [audio[start:end] for start, end in speech]
+        kept = sum(len(piece) for piece in pieces)
+        trimmed_ms = round((len(audio) - kept) * 1000 / _WHISPER_SAMPLE_RATE)
+
+        # Transcribe audio using pywhispercpp
+        logger.debug(f"Starting Whisper {model_name} transcription ({len(pieces)} piece(s), {trimmed_ms} ms trimmed)...")
+        _annotate(pieces=len(pieces), trimmed_ms=trimmed_ms)
+        texts = []
+        for piece in pieces:
+            segments = stt_scheduler.run(_transcribe, piece, model_name, timeout=timeout)
+            # pywhispercpp returns list of segments; combine all segment texts
+            texts.extend(seg.text.strip() for seg in segments)
+        logger.debug(f"Whisper transcription took {(time.perf_counter() - decoded) * 1000:.0f} ms")
+
+        # Only the length: transcripts are learner speech and stay out of logs.
+        text = ' '.join(t for t in texts if t)
+        _annotate(text_chars=len(text))
+
+        return {"text": text, "duration": duration, "trimmed_ms": trimmed_ms}
+
+    except _SchedulerError:
+        raise
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffmpeg could not decode audio: {e.stderr.decode(errors='replace').strip()}")
         return None
-    
-    try:
-        # Select voice based on type or specific ID
-        if voice_type == "alan" or voice_type == "male" or voice_id == 0:
-            voice = piper_male_voice
-            voice_name = "Alan (male)"
-        elif voice_type == "random":
-            import random
-            voice = random.choice([piper_male_voice, piper_female_voice])
-            voice_name = "Alan (male)" if voice == piper_male_voice else "Amy (female)"
-        else:  # Default to Amy (amy, female, or anything else)
-            voice = piper_female_voice
-            voice_name = "Amy (female)"
-        
-        logger.info(f"Using voice: {voice_name} (note: speed control not currently supported)")
-        
-        # Generate speech with Piper - use the simple approach
-        import subprocess
-        import json
-        
-        # Create temp file for output
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        try:
-            # Use piper CLI directly which is more reliable
-            model_path = "models/en_GB-alan-low.onnx" if "alan" in voice_name.lower() else "models/en_US-amy-low.onnx"
-            
-            # Run piper command
-            process = subprocess.run(
-                ["venv/bin/piper", "--model", model_path, "--output_file", temp_path],
-                input=text.encode('utf-8'),
-                capture_output=True,
-                timeout=10
-            )
-            
-            if process.returncode != 0:
-                logger.error(f"Piper command failed: {process.stderr.decode()}")
-                return None
-            
-            # Read the generated audio file
-            with open(temp_path, 'rb') as f:
-                audio_data = f.read()
-            
-            return audio_data
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-                
     except Exception as e:
-        logger.error(f"Piper TTS conversion failed: {e}")
+        logger.error(f"STT conversion failed ({type(e).__name__}): {e}")
         return None
 
-def speech_to_text(audio_data: bytes) -> Optional[dict]:
-    """Convert speech to text using Whisper"""
-    global whisper_model
-    
-    if not whisper_model:
-        logger.error("Whisper model not initialized")
-        return None
-    
-    try:
-        logger.info(f"Processing audio data: {len(audio_data)} bytes")
-        
-        # pywhispercpp requires 16kHz WAV, so we need to convert
-        import subprocess
-        import wave
-        
-        # Save incoming audio to temp file
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_input:
-            temp_input.write(audio_data)
-            input_path = temp_input.name
-        
-        # Convert to 16kHz WAV using ffmpeg
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_output:
-            output_path = temp_output.name
-        
-        try:
-            # Use ffmpeg to convert to 16kHz WAV
-            subprocess.run([
-                'ffmpeg', '-i', input_path,
-                '-ar', '16000',  # 16kHz sample rate
-                '-ac', '1',      # Mono
-                '-f', 'wav',
-                output_path,
-                '-y'  # Overwrite output
-            ], capture_output=True, check=True)
-            
-            logger.info(f"Converted audio to 16kHz WAV: {output_path}")
-            
-            # Transcribe audio using pywhispercpp
-            logger.info("Starting Whisper transcription...")
-            segments = whisper_model.transcribe(output_path)
-            
-            # pywhispercpp returns list of segments
-            if segments:
-                # Combine all segment texts
-                text = ' '.join([seg.text.strip() for seg in segments])
-                # Calculate total duration from last segment's end time (t1)
-                duration = segments[-1].t1 if segments else 0
+# Incremental transcription. /v1/audio/transcriptions only sees audio
+# after the learner stops talking, so the whole Whisper run sits on the
+# Turn's critical path. A transcription stream accepts 16-bit PCM while
+# the learner is still speaking and re-decodes the open window in the
+# background every EMBEDDED_STT_STREAM_STEP_MS of new audio. Once VAD
+# sees a pause of EMBEDDED_STT_STREAM_COMMIT_PAUSE_MS (or the window
+# reaches EMBEDDED_STT_STREAM_MAX_WINDOW_S), the window's text becomes
+# final and the window restarts, so each pass stays short and finishing
+# the stream only has to decode the last phrase.
+_STREAM_STEP_MS = int(os.environ.get("EMBEDDED_STT_STREAM_STEP_MS", 1000))
+_STREAM_COMMIT_PAUSE_MS = int(os.environ.get("EMBEDDED_STT_STREAM_COMMIT_PAUSE_MS", 600))
+_STREAM_MAX_WINDOW_S = float(os.environ.get("EMBEDDED_STT_STREAM_MAX_WINDOW_S", 20))
+_STREAM_IDLE_S = float(os.environ.get("EMBEDDED_STT_STREAM_IDLE_S", 60))
+_STREAM_MAX_SESSIONS = int(os.environ.get("EMBEDDED_STT_STREAM_MAX_SESSIONS", 4))
+
+
+class _TranscriptionStream:
+    """One in-progress utterance being transcribed as it arrives."""
+
+    def __init__(self, sample_rate: int, model_name: str):
+        self.id = uuid.uuid4().hex
+        self.sample_rate = sample_rate
+        self.model_name = model_name
+        self.cancel = _CancelToken()
+        self.last_active = time.monotonic()
+        self._lock = threading.Lock()
+        self._window = np.zeros(0, dtype=np.float32)  # audio not yet committed
+        self._undecoded = 0  # samples appended since the last decode pass
+        self._received = 0
+        self._final: List[str] = []
+        self._partial = ""
+        self._decoder: Optional[threading.Thread] = None
+
+    def append(self, pcm: bytes):
+        audio = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+        audio = _resample(audio, self.sample_rate)
+        with self._lock:
+            self.last_active = time.monotonic()
+            self._window = np.concatenate((self._window, audio))
+            self._undecoded += len(audio)
+            self._received += len(audio)
+            step = _WHISPER_SAMPLE_RATE * _STREAM_STEP_MS // 1000
+            if self._undecoded >= step and (self._decoder is None or not self._decoder.is_alive()):
+                self._decoder = threading.Thread(target=self._decode_loop, name=f"stt-stream-{self.id[:8]}", daemon=True)
+                self._decoder.start()
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "object": "transcription.stream",
+                "model": f"whisper-{self.model_name}",
+                "final": " ".join(self._final),
+                "partial": self._partial,
+                "duration": self._received / _WHISPER_SAMPLE_RATE,
+            }
+
+    def finish(self, timeout: Optional[float] = None) -> dict:
+        """Decode whatever is left and return the full transcript."""
+        decoder = self._decoder
+        if decoder is not None:
+            decoder.join()
+        self._decode_pass(final=True, timeout=timeout)
+        with self._lock:
+            return {"text": " ".join(self._final), "duration": self._received / _WHISPER_SAMPLE_RATE}
+
+    def _decode_loop(self):
+        step = _WHISPER_SAMPLE_RATE * _STREAM_STEP_MS // 1000
+        while not self.cancel.cancelled:
+            try:
+                self._decode_pass(final=False)
+            except _SchedulerError as e:
+                # Server busy or stream cancelled — the next append retries.
+                logger.info(f"Transcription stream {self.id[:8]}: decode pass skipped ({e})")
+                return
+            except Exception as e:
+                logger.error(f"Transcription stream {self.id[:8]}: decode pass failed: {e}")
+                return
+            with self._lock:
+                if self._undecoded < step:
+                    return
+
+    def _decode_pass(self, final: bool, timeout: Optional[float] = None):
+        with self._lock:
+            window = self._window
+            self._undecoded = 0
+
+        speech = _detect_speech(window) if len(window) else []
+        if not speech:
+            # Nothing but silence so far — drop it, keeping a pad's worth
+            # so a word starting right now isn't clipped.
+            keep = _WHISPER_SAMPLE_RATE * _VAD_PAD_MS // 1000
+            with self._lock:
+                self._window = self._window[max(0, len(window) - keep):]
+                self._partial = ""
+            return
+
+        start, end = speech[0][0], speech[-1][1]
+        pause = _WHISPER_SAMPLE_RATE * _STREAM_COMMIT_PAUSE_MS // 1000
+        commit = final or len(window) - end >= pause or len(window) >= _STREAM_MAX_WINDOW_S * _WHISPER_SAMPLE_RATE
+        if not commit:
+            end = len(window)  # still talking — decode up to the newest sample
+
+        segments = stt_scheduler.run(_transcribe, window[start:end], self.model_name,
+                                     timeout=timeout, cancel=self.cancel)
+        text = " ".join(t for t in (seg.text.strip() for seg in segments) if t)
+
+        with self._lock:
+            if commit:
+                if text:
+                    self._final.append(text)
+                self._partial = ""
+                # Audio appended while we were decoding sits past `end`.
+                self._window = self._window[end:]
             else:
-                text = ""
-                duration = 0
-            
-            logger.info(f"Transcription successful: '{text}' (duration: {duration}s)")
-            
-            if not text:
-                logger.warning("Transcription returned empty text")
-                return {"text": "", "duration": duration}
-            
-            return {"text": text, "duration": duration}
-            
-        except Exception as transcribe_error:
-            logger.error(f"Whisper transcription failed: {transcribe_error}")
-            logger.error(f"Error type: {type(transcribe_error).__name__}")
-            return None
-            
-        finally:
-            # Clean up temporary files
-            if 'input_path' in locals() and os.path.exists(input_path):
-                os.unlink(input_path)
-                logger.info(f"Cleaned up input file: {input_path}")
-            if 'output_path' in locals() and os.path.exists(output_path):
-                os.unlink(output_path)
-                logger.info(f"Cleaned up output file: {output_path}")
-                
-    except Exception as e:
-        logger.error(f"STT conversion failed: {e}")
-        logger.error(f"Error type: {type(e).__name__}")
-        return None
+                self._partial = text
+
+
+_streams_lock = threading.Lock()
+_transcription_streams: Dict[str, _TranscriptionStream] = {}
+
+
+def _reap_idle_streams():
+    now = time.monotonic()
+    with _streams_lock:
+        idle = [sid for sid, st in _transcription_streams.items() if now - st.last_active > _STREAM_IDLE_S]
+        for sid in idle:
+            _transcription_streams.pop(sid).cancel.cancel()
+    for sid in idle:
+        logger.info(f"Dropped idle transcription stream {sid[:8]}")
+
 
 # API Routes
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    components = {name: c.to_dict() for name, c in _all_components().items()}
     return jsonify({
         "status": "healthy",
+        "ready": _tts_usable() and _stt_usable(),
         "services": {
-            "tts": piper_male_voice is not None and piper_female_voice is not None,
-            "stt": whisper_model is not None
+            "tts": _tts_usable(),
+            "stt": _stt_usable()
         },
-        "voices": 2  # Alan and Amy
+        "components": components,
+        "voices": len(voice_registry.voices),
+        "voice_pool": voice_registry.stats(),
+        "whisper_pool": whisper_pool.stats(),
+        "stt_processes": stt_processes.stats() if stt_processes is not None else [],
+        "cache": tts_cache.stats(),
+        "threads": {
+            "cpus": _CPUS,
+            "tts": dict(zip(("intra_op", "inter_op"), _tts_threads())),
+            "whisper": _whisper_threads(whisper_pool.default) or min(4, _STT_CPU_SHARE),
+        },
+        "scheduler": {
+            "tts": tts_scheduler.stats(),
+            "stt": stt_scheduler.stats()
+        }
     })
 
+
+def _process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None  # not Linux
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the counters, histograms and gauges."""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+
+    schedulers = {"tts": tts_scheduler.stats(), "stt": stt_scheduler.stats()}
+    lines += _gauge("embedded_queue_depth", "Inference jobs waiting for a worker.", ("engine",),
+                    {(engine,): s["queued"] for engine, s in schedulers.items()})
+    lines += _gauge("embedded_queue_active", "Inference jobs running on a worker.", ("engine",),
+                    {(engine,): s["active"] for engine, s in schedulers.items()})
+    lines += ["# HELP embedded_scheduler_jobs_total Inference jobs by outcome.",
+              "# TYPE embedded_scheduler_jobs_total counter"]
+    for engine, s in schedulers.items():
+        for outcome in ("completed", "rejected", "expired", "cancelled"):
+            lines.append(f'embedded_scheduler_jobs_total{{engine="{engine}",outcome="{outcome}"}} {s[outcome]}')
+    with _inflight_lock:
+        inflight = len(_inflight)
+    lines += _gauge("embedded_inflight_requests", "Inference requests currently in flight.", (), {(): inflight})
+
+    pools = {"voice": voice_registry, "whisper": whisper_pool}
+    lines += _gauge("embedded_model_memory_bytes", "Estimated resident size of loaded models.", ("pool",),
+                    {(name,): pool.resident_bytes() for name, pool in pools.items()})
+    lines += _gauge("embedded_model_memory_budget_bytes", "Model memory budget (0 = unbounded).", ("pool",),
+                    {(name,): pool.memory_bytes for name, pool in pools.items()})
+    lines += _gauge("embedded_models_loaded", "Models loaded and ready.", ("pool",),
+                    {(name,): sum(c.state == "ready" for c in pool.components()) for name, pool in pools.items()})
+
+    cache = tts_cache.stats()
+    lines += _gauge("embedded_tts_cache_bytes", "Synthesized audio held by the TTS cache.", ("tier",),
+                    {("memory",): cache["memory_bytes"], ("disk",): cache["disk_bytes"]})
+    lines += ["# HELP embedded_tts_cache_lookups_total TTS cache lookups by result.",
+              "# TYPE embedded_tts_cache_lookups_total counter",
+              f'embedded_tts_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+              f'embedded_tts_cache_lookups_total{{result="miss"}} {cache["misses"]}']
+
+    lines += ["# HELP embedded_log_records_dropped_total Log records dropped because the log queue was full.",
+              "# TYPE embedded_log_records_dropped_total counter",
+              f"embedded_log_records_dropped_total {_log_handler.dropped}"]
+
+    rss = _process_rss_bytes()
+    if rss is not None:
+        lines += _gauge("embedded_process_resident_bytes", "Resident memory of the server process.", (), {(): rss})
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/v1/models', methods=['GET'])
 def list_models():
     """List available models (OpenAI-compatible)"""
     models = []
 
-    # Add TTS models. (Was `available_voices`, an undefined name — this
-    # endpoint crashed whenever TTS voices were loaded.)
-    loaded_voices = [
-        ("alan", "male", piper_male_voice),
-        ("amy", "female", piper_female_voice),
-    ]
-    for i, (name, gender, voice) in enumerate(loaded_voices):
-        if voice is None:
-            continue
+    # Add TTS models — every discovered voice, loaded or not; voices
+    # load on first use.
+    for info in voice_registry.voices.values():
         models.append({
-            "id": f"tts-voice-{i}",
+            "id": f"tts-voice-{info.id}",
             "object": "model",
             "created": 1677610602,
             "owned_by": "embedded-server",
             "permission": [],
-            "root": f"tts-voice-{i}",
+            "root": f"tts-voice-{info.id}",
             "parent": None,
-            "name": name,
-            "gender": gender
+            "name": info.speaker,
+            "key": info.key,
+            "gender": info.gender,
+            "language": info.language,
+            "loaded": voice_registry.component(info.key).state == "ready"
         })
     
-    # Add STT model
-    if whisper_model:
+    # Add STT models — every model transcription requests may select
+    for name in whisper_pool.names:
         models.append({
-            "id": "whisper-tiny",
-            "object": "model", 
+            "id": f"whisper-{name}",
+            "object": "model",
             "created": 1677610602,
             "owned_by": "embedded-server",
             "permission": [],
-            "root": "whisper-tiny",
-            "parent": None
+            "root": f"whisper-{name}",
+            "parent": None,
+            "default": name == whisper_pool.default,
+            "loaded": whisper_pool.component(name).state == "ready"
         })
     
     return jsonify({"object": "list", "data": models})
@@ -414,7 +2882,8 @@ def list_models():
 @app.route('/v1/voices', methods=['GET'])
 def list_voices():
     """List available voices categorized by gender"""
-    if not piper_male_voice or not piper_female_voice:
+    voice_registry.discovered.wait(_LOAD_WAIT_S)
+    if not voice_registry.voices:
         return jsonify({"error": "Piper voices not available"}), 500
     
     categorized = categorize_voices()
@@ -426,14 +2895,15 @@ def list_voices():
             "female": categorized["female"], 
             "unknown": categorized["unknown"],
             "all": categorized["all"],
-            "total": 2
+            "total": len(categorized["all"])
         }
     })
 
 @app.route('/v1/voices/<gender>', methods=['GET'])
 def list_voices_by_gender(gender):
     """List voices filtered by gender (male/female/unknown/all)"""
-    if not piper_male_voice or not piper_female_voice:
+    voice_registry.discovered.wait(_LOAD_WAIT_S)
+    if not voice_registry.voices:
         return jsonify({"error": "Piper voices not available"}), 500
     
     categorized = categorize_voices()
@@ -454,51 +2924,256 @@ def create_speech():
         data = request.get_json()
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
         
-        text = data.get('input', '')
+        # Extract text and voice parameters
+        model = data.get('model', '')
+        try:
+            text = _text_input(data)
+            voice, voice_id, length_scale = _voice_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         if not text:
             return jsonify({"error": "No input text provided"}), 400
         
-        # Extract voice parameters
-        model = data.get('model', '')
-        voice = data.get('voice', 'female')
-        voice_id = data.get('voice_id', None)  # Specific voice ID
-        speed = data.get('speed', 1.2)  # Speech speed multiplier (default 1.2x)
-        
-        # Convert speed to Piper length_scale (inverse relationship)
-        length_scale = 1.0 / speed if speed > 0 else 0.83  # Default to 1.2x speed
-        
-        # Determine voice type from various parameters
-        voice_type = "amy"  # default to Amy
-        if voice == "random":
-            voice_type = "random"
-        elif voice.lower() == 'alan' or 'male' in voice.lower():
-            voice_type = "alan"
-        elif voice.lower() == 'amy' or 'female' in voice.lower():
-            voice_type = "amy"
-        
+        # The voice can be a registry key (en_GB-alan-low), a speaker
+        # name (alan), "male"/"female" for the default voices, or "random".
+
+        response_format = data.get('response_format', 'wav')
+        if not isinstance(response_format, str):
+            return jsonify({"error": "'response_format' must be a string"}), 400
+        if response_format != 'pcm' and response_format not in _AUDIO_FORMATS:
+            supported = ", ".join(["pcm"] + list(_AUDIO_FORMATS))
+            return jsonify({"error": f"Unsupported response_format '{response_format}'. Use: {supported}"}), 400
+
+        # Streaming mode: opt in with "stream": true (WAV with an
+        # open-ended header) or response_format "pcm" (raw s16le mono).
+        # Audio goes out sentence by sentence over a chunked response.
+        # Compressed formats are always returned whole.
+        if response_format == 'pcm' or (data.get('stream') and response_format == 'wav'):
+            container = 'pcm' if response_format == 'pcm' else 'wav'
+            streamed = text_to_speech_stream(text, voice, voice_id, length_scale, container,
+                                             _request_timeout(tts_scheduler.timeout_s))
+            if streamed is None:
+                return jsonify({"error": "Failed to generate speech"}), 500
+            sample_rate, chunks = streamed
+            mimetype = 'audio/pcm' if container == 'pcm' else 'audio/wav'
+            return Response(
+                stream_with_context(chunks),
+                mimetype=mimetype,
+                headers={"X-Sample-Rate": str(sample_rate)},
+            )
+
         # Generate speech with voice selection and speed
-        audio_data = text_to_speech(text, voice_type, voice_id, length_scale)
-        if not audio_data:
+        synthesized = text_to_speech(text, voice, voice_id, length_scale,
+                                     _request_timeout(tts_scheduler.timeout_s))
+        if not synthesized:
             return jsonify({"error": "Failed to generate speech"}), 500
-        
-        # Create temporary file to return
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            temp_file.write(audio_data)
-            temp_path = temp_file.name
-        
-        return send_file(temp_path, as_attachment=True, download_name='speech.wav', mimetype='audio/wav')
-        
+        pcm, sample_rate = synthesized
+
+        started = time.perf_counter()
+        audio_data = _encode_audio(pcm, sample_rate, response_format)
+        encode_ms = (time.perf_counter() - started) * 1000
+        logger.debug(f"Encoded {response_format}: {len(audio_data)} bytes "
+                     f"({len(pcm) + 44} as WAV) in {encode_ms:.0f} ms")
+        _annotate(format=response_format, encode_ms=round(encode_ms, 1))
+        _, _, mimetype, extension = _AUDIO_FORMATS[response_format]
+
+        # Serve straight from memory. This used to write every response to
+        # a NamedTemporaryFile(delete=False) that nothing ever removed, so
+        # a long session grew the temp directory without bound. (Not
+        # send_file: its passthrough response skips call_on_close, which
+        # leaked every request's _inflight entry.)
+        response = Response(audio_data, mimetype=mimetype, headers={
+            "Content-Disposition": f"attachment; filename=speech.{extension}",
+        })
+        response.headers["X-Encode-Ms"] = f"{encode_ms:.1f}"
+        return response
+
+    except _SchedulerError as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"Speech generation error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/v1/audio/speech/batch', methods=['POST'])
+def create_speech_batch():
+    """Pre-render a list of {input, voice, speed} items into the TTS cache"""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Provide a non-empty 'items' list"}), 400
+    if len(items) > _BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {_BATCH_MAX_ITEMS} items per batch"}), 400
+    if not tts_cache.enabled:
+        return jsonify({"error": "TTS cache is disabled; nothing to pre-render into"}), 409
+
+    timeout = _request_timeout(tts_scheduler.timeout_s)
+    cancel = _request_cancel_token() or _CancelToken()
+    started = time.perf_counter()
+    logger.info(f"Pre-rendering batch of {len(items)} item(s)")
+    _annotate(items=len(items))
+
+    def summary(results: List[dict]) -> dict:
+        failed = sum(1 for r in results if "error" in r)
+        cached = sum(1 for r in results if r.get("cached"))
+        elapsed_ms = round((time.perf_counter() - started) * 1000)
+        logger.info(f"Batch done: {len(results) - failed - cached} rendered, {cached} already cached, "
+                    f"{failed} failed in {elapsed_ms} ms")
+        return {"rendered": len(results) - failed - cached, "cached": cached, "failed": failed,
+                "elapsed_ms": elapsed_ms}
+
+    if data.get('stream'):
+        # NDJSON progress: one line per item as it finishes, then a summary.
+        def generate():
+            results = []
+            completed = False
+            try:
+                for result in text_to_speech_batch(items, timeout, cancel):
+                    results.append(result)
+                    yield json.dumps(dict(result, object="batch.item")) + "\n"
+                yield json.dumps(dict(summary(results), object="batch.done")) + "\n"
+                completed = True
+            finally:
+                if not completed:
+                    cancel.cancel()
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    results = sorted(text_to_speech_batch(items, timeout, cancel), key=lambda r: r["index"])
+    return jsonify(dict(summary(results), object="list", data=results))
+
+
+@app.route('/v1/audio/speech/cache/<audio_id>', methods=['GET'])
+def get_cached_speech(audio_id):
+    """Fetch pre-rendered audio by the ID a batch returned (?format=wav|flac|opus|...)"""
+    response_format = request.args.get('format', 'wav')
+    if response_format not in _AUDIO_FORMATS:
+        return jsonify({"error": f"Unsupported format '{response_format}'. Use: {', '.join(_AUDIO_FORMATS)}"}), 400
+    cached = tts_cache.get(audio_id) if len(audio_id) == 64 else None
+    if cached is None:
+        return jsonify({"error": f"No cached audio '{audio_id}' (never rendered, or evicted)"}), 404
+    pcm, sample_rate = cached
+    return Response(_encode_audio(pcm, sample_rate, response_format), mimetype=_AUDIO_FORMATS[response_format][2])
+
+
+@app.route('/v1/audio/speech/sessions', methods=['POST'])
+def create_speech_session():
+    """Open an incremental TTS session (optionally with the first text)"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    response_format = data.get('response_format', 'wav')
+    if response_format not in ('wav', 'pcm'):
+        return jsonify({"error": "Speech sessions stream 'wav' or 'pcm'"}), 400
+    try:
+        voice, voice_id, length_scale = _voice_options(data)
+        text = _text_input(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    piper_voice, info = _select_voice(voice, voice_id)
+    if piper_voice is None:
+        return jsonify({"error": "Voice not available"}), 503
+
+    _reap_idle_speech_sessions()
+    with _speech_sessions_lock:
+        if len(_speech_sessions) >= _TTS_SESSION_MAX:
+            return jsonify({"error": "Too many open speech sessions"}), 429
+        session = _SpeechSession(piper_voice, info, length_scale, response_format)
+        _speech_sessions[session.id] = session
+    if text:
+        session.append(text)
+    logger.debug(f"Opened speech session {session.id[:8]} with voice {info.key}")
+    return jsonify(session.state()), 201
+
+
+@app.route('/v1/audio/speech/sessions/<session_id>', methods=['POST'])
+def append_speech_session(session_id):
+    """Append a text delta ({"input": ...} or a text/plain body)"""
+    # Deltas arrive at LLM token rate; one trace per reply comes from the
+    # audio request instead.
+    g.pop("trace", None)
+    session = _get_speech_session(session_id)
+    if session is None:
+        return jsonify({"error": f"No speech session '{session_id}'"}), 404
+    data = request.get_json(silent=True)
+    try:
+        text = _text_input(data) if isinstance(data, dict) else request.get_data(as_text=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not session.append(text):
+        return jsonify({"error": "Speech session is already finished"}), 409
+    return jsonify(session.state())
+
+
+@app.route('/v1/audio/speech/sessions/<session_id>/finish', methods=['POST'])
+def finish_speech_session(session_id):
+    """No more text: speak what is buffered as the last sentence"""
+    session = _get_speech_session(session_id)
+    if session is None:
+        return jsonify({"error": f"No speech session '{session_id}'"}), 404
+    data = request.get_json(silent=True)
+    try:
+        text = _text_input(data) if isinstance(data, dict) else request.get_data(as_text=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session.finish(text)
+    return jsonify(session.state())
+
+
+@app.route('/v1/audio/speech/sessions/<session_id>/audio', methods=['GET'])
+def stream_speech_session(session_id):
+    """The session's audio, sentence by sentence, until it is finished"""
+    session = _get_speech_session(session_id)
+    if session is None:
+        return jsonify({"error": f"No speech session '{session_id}'"}), 404
+    with _speech_sessions_lock:
+        if session.reader_attached:
+            return jsonify({"error": "Speech session audio is already being read"}), 409
+        session.reader_attached = True
+    session.trace = _current_trace()
+    _annotate(voice=session.info.key, session=session.id)
+    # DELETE /v1/requests/<id> on this request cancels the session.
+    cancel = _request_cancel_token()
+    if cancel is not None:
+        cancel.on_cancel(session.cancel.cancel)
+
+    def generate():
+        completed = False
+        try:
+            yield from session.audio()
+            completed = not session.cancel.cancelled
+        finally:
+            # Closed early: the client disconnected (barge-in) — stop
+            # synthesizing the rest of the reply.
+            if not completed:
+                session.cancel.cancel()
+            with _speech_sessions_lock:
+                _speech_sessions.pop(session.id, None)
+            state = session.state()
+            _annotate(chars=state["received_chars"], sentences=state["synthesized"])
+
+    mimetype = 'audio/pcm' if session.container == 'pcm' else 'audio/wav'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"X-Sample-Rate": str(session.sample_rate)})
+
+
+@app.route('/v1/audio/speech/sessions/<session_id>', methods=['DELETE'])
+def delete_speech_session(session_id):
+    """Stop a session: pending sentences are dropped and its audio ends"""
+    with _speech_sessions_lock:
+        session = _speech_sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({"error": f"No speech session '{session_id}'"}), 404
+    session.cancel.cancel()
+    return jsonify({"id": session_id, "deleted": True})
+
+
 @app.route('/v1/audio/transcriptions', methods=['POST'])
 def create_transcription():
     """Speech-to-text endpoint (OpenAI-compatible)"""
     try:
-        logger.info(f"Received transcription request from {request.remote_addr}")
-        
         # Check if file is in request
         if 'file' not in request.files:
             logger.error("No audio file in request")
@@ -509,14 +3184,24 @@ def create_transcription():
             logger.error("No file selected")
             return jsonify({"error": "No file selected"}), 400
         
-        logger.info(f"Processing audio file: {audio_file.filename}, content type: {audio_file.content_type}")
-        
         # Read audio data
         audio_data = audio_file.read()
-        logger.info(f"Read {len(audio_data)} bytes of audio data")
+        logger.debug(f"Read {len(audio_data)} bytes from {audio_file.filename} ({audio_file.content_type})")
         
-        # Transcribe audio
-        result = speech_to_text(audio_data)
+        # Transcribe audio. Raw PCM uploads carry no header, so the
+        # sample rate comes from an optional form field.
+        content_type = audio_file.mimetype or ""
+        if audio_file.filename and audio_file.filename.lower().endswith('.pcm'):
+            content_type = 'audio/pcm'
+        try:
+            sample_rate = _pcm_sample_rate(request.form.get('sample_rate', _WHISPER_SAMPLE_RATE))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        model_name = whisper_pool.resolve(request.form.get('model'))
+        if model_name is None:
+            return jsonify({"error": f"Unknown or disallowed model '{request.form.get('model')}'"}), 400
+        result = speech_to_text(audio_data, content_type, sample_rate,
+                                _request_timeout(stt_scheduler.timeout_s), model_name)
         if result is None:
             logger.error("Speech-to-text function returned None")
             return jsonify({"error": "Failed to transcribe audio"}), 500
@@ -525,60 +3210,258 @@ def create_transcription():
         if isinstance(result, str):
             text = result
             duration = 0
-            logger.info(f"Got string result: {text}")
+            trimmed_ms = 0
         else:
             text = result.get("text", "")
             duration = result.get("duration", 0)
-            logger.info(f"Got dict result: text='{text}', duration={duration}")
+            trimmed_ms = result.get("trimmed_ms", 0)
         
-        # Return OpenAI-compatible response
+        # Return OpenAI-compatible response (trimmed_ms is an extension:
+        # how much silence VAD cut before inference)
         response_data = {
             "text": text,
-            "duration": duration
+            "duration": duration,
+            "trimmed_ms": trimmed_ms
         }
-        logger.info(f"Returning response: {response_data}")
         return jsonify(response_data)
-        
+
+    except _SchedulerError as e:
+        return _overloaded_response(e)
     except Exception as e:
-        logger.error(f"Transcription error: {e}")
-        logger.error(f"Error type: {type(e).__name__}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.exception(f"Transcription error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/v1/audio/transcriptions/stream', methods=['POST'])
+def create_transcription_stream():
+    """Open an incremental transcription stream"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        sample_rate = _pcm_sample_rate(data.get('sample_rate', _WHISPER_SAMPLE_RATE))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    model_name = whisper_pool.resolve(data.get('model'))
+    if model_name is None:
+        return jsonify({"error": f"Unknown or disallowed model '{data.get('model')}'"}), 400
+    if not whisper_pool.component(model_name).ensure(_LOAD_WAIT_S):
+        return jsonify({"error": f"Whisper {model_name} model not available"}), 503
+
+    _reap_idle_streams()
+    with _streams_lock:
+        if len(_transcription_streams) >= _STREAM_MAX_SESSIONS:
+            return jsonify({"error": "Too many open transcription streams"}), 429
+        stream = _TranscriptionStream(sample_rate, model_name)
+        _transcription_streams[stream.id] = stream
+
+    logger.debug(f"Opened transcription stream {stream.id[:8]} at {sample_rate} Hz (whisper {model_name})")
+    return jsonify(stream.state()), 201
+
+
+def _get_transcription_stream(stream_id: str) -> Optional[_TranscriptionStream]:
+    with _streams_lock:
+        return _transcription_streams.get(stream_id)
+
+
+@app.route('/v1/audio/transcriptions/stream/<stream_id>', methods=['POST'])
+def append_transcription_stream(stream_id):
+    """Append raw s16le PCM frames; returns the current partial/final text"""
+    stream = _get_transcription_stream(stream_id)
+    if stream is None:
+        return jsonify({"error": f"No transcription stream '{stream_id}'"}), 404
+    stream.append(request.get_data())
+    return jsonify(stream.state())
+
+
+@app.route('/v1/audio/transcriptions/stream/<stream_id>/finish', methods=['POST'])
+def finish_transcription_stream(stream_id):
+    """Close a stream and return the final transcript"""
+    with _streams_lock:
+        stream = _transcription_streams.pop(stream_id, None)
+    if stream is None:
+        return jsonify({"error": f"No transcription stream '{stream_id}'"}), 404
+    try:
+        payload = request.get_data()
+        if payload:
+            stream.append(payload)
+        result = stream.finish(_request_timeout(stt_scheduler.timeout_s))
+    except _SchedulerError as e:
+        return _overloaded_response(e)
+    logger.debug(f"Finished transcription stream {stream_id[:8]} ({result['duration']:.2f}s of audio)")
+    return jsonify(result)
+
+
+@app.route('/v1/audio/transcriptions/stream/<stream_id>', methods=['DELETE'])
+def delete_transcription_stream(stream_id):
+    """Discard a stream without a final decode"""
+    with _streams_lock:
+        stream = _transcription_streams.pop(stream_id, None)
+    if stream is None:
+        return jsonify({"error": f"No transcription stream '{stream_id}'"}), 404
+    stream.cancel.cancel()
+    return jsonify({"id": stream_id, "deleted": True})
+
+
+@app.route('/v1/requests/<request_id>', methods=['DELETE'])
+def cancel_request(request_id):
+    """Cancel an in-flight synthesis/transcription (barge-in)"""
+    with _inflight_lock:
+        token = _inflight.get(request_id)
+    if token is None:
+        return jsonify({"error": f"No in-flight request '{request_id}'"}), 404
+    token.cancel()
+    logger.info(f"Cancelled request {request_id}")
+    return jsonify({"id": request_id, "cancelled": True})
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
-    """Shutdown the server"""
-    logger.info("Shutdown requested")
-    
-    # Cleanup (Piper voices will be cleaned up automatically)
-    
-    # Shutdown Flask server
-    shutdown_server = request.environ.get('werkzeug.server.shutdown')
-    if shutdown_server is None:
-        return jsonify({"error": "Cannot shutdown server"}), 500
-    
-    shutdown_server()
+    """Shutdown the server, after in-flight requests finish"""
+    # (This used werkzeug.server.shutdown, which Werkzeug 2.1 removed —
+    # the endpoint always answered 500 and the app fell back to SIGKILL.)
+    threading.Thread(target=_graceful_shutdown, args=("Shutdown requested",), daemon=True).start()
     return jsonify({"message": "Server shutting down..."})
 
+
+# Serving. By default the app runs under waitress, a production WSGI
+# server that works the same on Windows, macOS and Linux. It gives HTTP/1.1
+# keep-alive and a fixed pool of EMBEDDED_SERVER_THREADS request threads.
+# It is a single process, so models load exactly once and are shared by
+# every thread; the inference schedulers still bound the concurrency.
+# EMBEDDED_SERVER=dev (or a missing waitress) uses Werkzeug's threaded
+# development server instead.
+#
+# Shutdown is the same for /shutdown, SIGTERM and Ctrl-C:
+# 1. stop admitting inference;
+# 2. wait up to EMBEDDED_DRAIN_TIMEOUT_S for in-flight requests
+#    (including streamed responses) to finish;
+# 3. stop the server.
+_SERVER_RUNTIME = os.environ.get("EMBEDDED_SERVER", "waitress").lower()
+_SERVER_THREADS = int(os.environ.get("EMBEDDED_SERVER_THREADS", 8))
+_DRAIN_TIMEOUT_S = float(os.environ.get("EMBEDDED_DRAIN_TIMEOUT_S", 10))
+_stop_server = None  # set by main(): makes the serving loop return
+
+
+def _graceful_shutdown(reason: str):
+    if _draining.is_set():
+        return
+    _draining.set()
+    logger.info(f"{reason}: draining in-flight requests (up to {_DRAIN_TIMEOUT_S:.0f}s)")
+    # Appends are refused from here on, so speak what each open speech
+    # session already has rather than wait out the drain for more text.
+    with _speech_sessions_lock:
+        sessions = list(_speech_sessions.values())
+    for session in sessions:
+        session.finish()
+    deadline = time.monotonic() + _DRAIN_TIMEOUT_S
+    while time.monotonic() < deadline:
+        with _inflight_lock:
+            remaining = len(_inflight)
+        if not remaining:
+            break
+        time.sleep(0.05)
+    else:
+        logger.warning(f"Drain timed out with {remaining} request(s) still in flight")
+    with _streams_lock:
+        streams = list(_transcription_streams.values())
+        _transcription_streams.clear()
+    for stream in streams:
+        stream.cancel.cancel()
+    if _stop_server is not None:
+        _stop_server()
+
+
+def _waitress_can_drain(server) -> bool:
+    """Whether this waitress has the internals _close_waitress() relies on.
+
+    waitress has no public way to stop run(); requirements.txt pins the
+    major versions this was written against, and this catches the rest."""
+    from waitress import wasyncore
+
+    trigger = getattr(server, "trigger", None)
+    return (isinstance(server, wasyncore.dispatcher)
+            and isinstance(getattr(server, "_map", None), dict)
+            and all(hasattr(trigger, name) for name in ("pull_trigger", "del_channel", "close"))
+            and hasattr(getattr(server, "task_dispatcher", None), "shutdown"))
+
+
+def _close_waitress(server):
+    """Runs on waitress's event loop: stop accepting, close connections once flushed."""
+    from waitress import wasyncore
+
+    # Only the listening socket: the server's own close() also closes the
+    # trigger, which task threads still pull as their responses finish.
+    wasyncore.dispatcher.close(server)
+    for channel in list(server._map.values()):
+        if hasattr(channel, "close_when_flushed"):
+            channel.close_when_flushed = True  # idle keep-alive connections close right away
+        elif channel is not server.trigger:
+            channel.close()
+    # Leave the loop's map (so run() returns) but keep the pipe open: a
+    # task thread still running response-close callbacks pulls it as it
+    # finishes. _serve() closes it once those threads are joined.
+    server.trigger.del_channel()
+
+
+def _serve(host: str, port: int):
+    """Run the WSGI server until _graceful_shutdown() stops it."""
+    global _stop_server
+    runtime = _SERVER_RUNTIME
+    if runtime == "waitress":
+        try:
+            from waitress import create_server
+        except ImportError:
+            logger.warning("waitress is not installed; falling back to the Flask development server")
+            runtime = "dev"
+
+    if runtime == "waitress":
+        server = create_server(
+            app, host=host, port=port, threads=_SERVER_THREADS, ident="embedded-server",
+            # Flush every write: streamed TTS sentences must not sit in the
+            # output buffer waiting for 18 KB to accumulate.
+            send_bytes=1,
+        )
+        if not _waitress_can_drain(server):
+            from importlib.metadata import version
+            logger.warning(f"waitress {version('waitress')} can't be drained on shutdown; "
+                           "falling back to the Flask development server")
+            server.close()
+            runtime = "dev"
+
+    if runtime == "waitress":
+        _stop_server = lambda: server.trigger.pull_trigger(functools.partial(_close_waitress, server))
+        logger.info(f"Serving with waitress ({_SERVER_THREADS} threads)")
+        server.run()
+        server.task_dispatcher.shutdown()
+        server.trigger.close()
+    else:
+        from werkzeug.serving import make_server
+        server = make_server(host, port, app, threaded=True)
+        _stop_server = server.shutdown
+        logger.info("Serving with the Flask development server")
+        server.serve_forever()
+
+
+def _handle_signal(signum, _frame):
+    if _draining.is_set():
+        logger.warning("Second signal: exiting without waiting for in-flight requests")
+        os._exit(1)
+    # Drain off the main thread — it is running the server loop.
+    threading.Thread(target=_graceful_shutdown, args=(f"Received {signal.Signals(signum).name}",),
+                     daemon=True).start()
+
+
 def main():
     """Main entry point"""
     logger.info("Starting embedded TTS/STT server...")
     
-    # Initialize services
-    tts_success = initialize_tts()
-    stt_success = initialize_whisper()
-    
-    if not tts_success and not stt_success:
-        logger.error("Failed to initialize both TTS and STT services")
-        sys.exit(1)
-    
-    if not tts_success:
-        logger.warning("TTS service failed to initialize")
-    
-    if not stt_success:
-        logger.warning("STT service failed to initialize")
-    
+    global stt_processes
+    if _STT_PROCESSES > 0:
+        stt_processes = _WhisperProcessPool(_STT_PROCESSES)
+
+    # Load models in the background; /health reports per-component
+    # progress while the server is already accepting requests.
+    _start_background_loading()
+
     # Start server
     port = int(os.environ.get('PORT', 8765))
     host = os.environ.get('HOST', '127.0.0.1')
@@ -590,8 +3473,16 @@ def main():
     logger.info("  POST /v1/audio/speech            - Text-to-speech")
     logger.info("  POST /v1/audio/transcriptions    - Speech-to-text")
     logger.info("  POST /shutdown                   - Shutdown server")
-    
-    app.run(host=host, port=port, debug=False, use_reloader=False)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, _handle_signal)
+    _serve(host, port)
+
+    if stt_processes is not None:
+        stt_processes.close()
+    logger.info("Server stopped")
+    _log_listener.stop()  # flush queued records before the process exits
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # STT worker processes in PyInstaller builds
     main()
\ No newline at end of file
@@ -435,9 +435,8 @@ async function startEmbeddedServer() {
           console.log('Embedded server is ready');
           // Update database with embedded server URL
           await updateEmbeddedServerConfig();
-          // Fire-and-forget warmup so Piper/Whisper load their models in
-          // the background instead of on the student's first utterance.
-          warmupEmbeddedServer(`http://127.0.0.1:${embeddedServerPort}`);
+          // No client-side warmup needed: the server loads and warms
+          // Piper/Whisper itself and reports progress on /health.
           return true;
         }
       } catch (error) {
@@ -461,6 +460,9 @@ async function startEmbeddedServer() {
 function stopEmbeddedServer() {
   if (embeddedServer) {
     console.log('Stopping embedded server...');
+    // Keep our own handle: embeddedServer is cleared below, before the
+    // fallback timers run, so they used to find nothing to kill.
+    const serverProcess = embeddedServer;
     
     // Try graceful shutdown first
     try {
@@ -474,13 +476,14 @@ function stopEmbeddedServer() {
       console.log('Graceful shutdown failed, forcing termination');
     }
     
-    // Force kill after 5 seconds
+    // /shutdown drains in-flight requests before exiting. If the server is
+    // still up after 5 seconds, SIGTERM (which also drains), then SIGKILL.
     setTimeout(() => {
-      if (embeddedServer && !embeddedServer.killed) {
-        embeddedServer.kill('SIGTERM');
+      if (serverProcess.exitCode === null && !serverProcess.killed) {
+        serverProcess.kill('SIGTERM');
         setTimeout(() => {
-          if (embeddedServer && !embeddedServer.killed) {
-            embeddedServer.kill('SIGKILL');
+          if (serverProcess.exitCode === null) {
+            serverProcess.kill('SIGKILL');
           }
         }, 2000);
       }
@@ -490,71 +493,6 @@ function stopEmbeddedServer() {
   }
 }
 
-// Pre-load Piper and Whisper models in the background by firing tiny
-// requests against the embedded server right after /health succeeds.
-// Both models are otherwise lazy-loaded on first real request, which
-// makes the student's first utterance feel laggy. Fire-and-forget;
-// failures here are non-fatal.
-async function warmupEmbeddedServer(baseUrl) {
-  // TTS warmup — Piper loads the voice model on first synth.
-  try {
-    await fetch(`${baseUrl}/v1/audio/speech`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'Authorization': `Bearer ${embeddedServerToken}`,
-      },
-      body: JSON.stringify({
-        model: 'tts-embedded',
-        input: 'hi',
-        voice: 'amy',
-        speed: 1.0,
-        response_format: 'wav',
-      }),
-    });
-    console.log('[embedded-server] TTS warmup complete');
-  } catch (e) {
-    console.warn('[embedded-server] TTS warmup failed (non-fatal):', e.message);
-  }
-
-  // STT warmup — Whisper loads the model on first transcription.
-  // Build a minimal valid WAV file (header + 0.5s of silence) and POST
-  // it as multipart so the server takes the same code path as a real
-  // transcription request.
-  try {
-    const sampleRate = 16000;
-    const numSamples = sampleRate / 2; // 0.5s
-    const dataSize = numSamples * 2; // 16-bit mono
-    const wav = Buffer.alloc(44 + dataSize);
-    wav.write('RIFF', 0);
-    wav.writeUInt32LE(36 + dataSize, 4);
-    wav.write('WAVE', 8);
-    wav.write('fmt ', 12);
-    wav.writeUInt32LE(16, 16);
-    wav.writeUInt16LE(1, 20);
-    wav.writeUInt16LE(1, 22);
-    wav.writeUInt32LE(sampleRate, 24);
-    wav.writeUInt32LE(sampleRate * 2, 28);
-    wav.writeUInt16LE(2, 32);
-    wav.writeUInt16LE(16, 34);
-    wav.write('data', 36);
-    wav.writeUInt32LE(dataSize, 40);
-    // Audio bytes are already zeros from Buffer.alloc → silence.
-
-    const formData = new FormData();
-    formData.append('file', new Blob([wav], { type: 'audio/wav' }), 'warmup.wav');
-    formData.append('response_format', 'json');
-    await fetch(`${baseUrl}/v1/audio/transcriptions`, {
-      method: 'POST',
-      headers: { 'Authorization': `Bearer ${embeddedServerToken}` },
-      body: formData,
-    });
-    console.log('[embedded-server] STT warmup complete');
-  } catch (e) {
-    console.warn('[embedded-server] STT warmup failed (non-fatal):', e.message);
-  }
-}
-
 async function testEmbeddedServerHealth() {
   return new Promise((resolve, reject) => {
     const request = net.request({